@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import requests
+
+
+CACHE_DIR_ENV = "GO_API_CACHE_DIR"
+CACHE_TTL_ENV = "GO_API_CACHE_TTL"
+CACHE_MAX_BYTES_ENV = "GO_API_CACHE_MAX_BYTES"
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response, served from the on-disk cache."""
+
+    def __init__(self, url, status_code, content, headers):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.ok = status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of GO API GET responses.
+
+    Bodies are stored once per content hash under blobs/, and each request
+    (url + headers) has a small entry under entries/ pointing at its blob.
+    Entries younger than the TTL are served directly; older ones are revalidated
+    with If-None-Match / If-Modified-Since. When the blobs exceed max_bytes, the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'blobs'), exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(path) for path in self._blob_paths())
+
+    def _blob_paths(self):
+        blob_dir = os.path.join(self.cache_dir, 'blobs')
+        return [os.path.join(blob_dir, name) for name in os.listdir(blob_dir) if not name.endswith('.tmp')]
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, 'entries', key + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest)
+
+    @staticmethod
+    def _key(url, headers):
+        """Hashes the url and request headers, so different tokens never share an entry."""
+        material = json.dumps([url, sorted((headers or {}).items())])
+        return hashlib.sha256(material.encode('utf8')).hexdigest()
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                entry = json.load(f)
+            with open(self._blob_path(entry['blob']), 'rb') as f:
+                return entry, f.read()
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None, None
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _store(self, key, url, response):
+        digest = hashlib.sha256(response.content).hexdigest()
+        entry = {
+            'url': url,
+            'blob': digest,
+            'size': len(response.content),
+            'stored_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_type': response.headers.get('Content-Type'),
+        }
+        with self._lock:
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                self._write_atomic(blob_path, response.content)
+                self._total_bytes += len(response.content)
+            self._write_atomic(self._entry_path(key), json.dumps(entry).encode('utf8'))
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops least recently used entries until the blobs fit in max_bytes (lock held)."""
+        entry_dir = os.path.join(self.cache_dir, 'entries')
+        entries = []
+        for name in os.listdir(entry_dir):
+            path = os.path.join(entry_dir, name)
+            try:
+                with open(path) as f:
+                    entries.append((os.path.getmtime(path), path, json.load(f)['blob']))
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                continue
+        entries.sort()
+
+        referenced = {}
+        for _, _, blob in entries:
+            referenced[blob] = referenced.get(blob, 0) + 1
+
+        # blobs left behind when an entry was re-pointed at new content go first
+        for path in self._blob_paths():
+            if os.path.basename(path) not in referenced:
+                self._total_bytes -= os.path.getsize(path)
+                os.remove(path)
+
+        for _, path, blob in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            self.stats['evictions'] += 1
+            referenced[blob] -= 1
+            if referenced[blob] == 0 and os.path.exists(self._blob_path(blob)):
+                self._total_bytes -= os.path.getsize(self._blob_path(blob))
+                os.remove(self._blob_path(blob))
+
+    def get(self, url, headers=None, session=None, ttl=None):
+        """GETs url, serving it from the cache when fresh or revalidated."""
+        ttl = self.ttl if ttl is None else ttl
+        key = self._key(url, headers)
+        entry, content = self._read_entry(key)
+
+        if entry is not None and time.time() - entry['stored_at'] < ttl:
+            self._count('hits')
+            self._touch(key)
+            return CachedResponse(url, 200, content, {'Content-Type': entry['content_type']})
+
+        request_headers = dict(headers or {})
+        if entry is not None and entry['etag']:
+            request_headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            request_headers['If-Modified-Since'] = entry['last_modified']
+
+        response = (session or requests).get(url, headers=request_headers)
+
+        if response.status_code == 304 and entry is not None:
+            self._count('revalidated')
+            entry['stored_at'] = time.time()
+            with self._lock:
+                self._write_atomic(self._entry_path(key), json.dumps(entry).encode('utf8'))
+            return CachedResponse(url, 200, content, {'Content-Type': entry['content_type']})
+
+        self._count('misses')
+        if response.status_code == 200:
+            self._store(key, url, response)
+        return response
+
+    def log_stats(self):
+        requests_served = self.stats['hits'] + self.stats['revalidated'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] + self.stats['revalidated']) / requests_served if requests_served else 0
+        logging.info(f"GO API cache: {self.stats['hits']} hits, {self.stats['revalidated']} revalidated, "
+                     f"{self.stats['misses']} misses ({hit_rate:.0%} served locally), {self.stats['evictions']} evictions")
+
+
+def from_env():
+    """Returns a ResponseCache when GO_API_CACHE_DIR is set, otherwise None (caching disabled)."""
+    cache_dir = os.getenv(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    ttl = float(os.getenv(CACHE_TTL_ENV, DEFAULT_TTL))
+    max_bytes = int(os.getenv(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+    return ResponseCache(cache_dir, ttl=ttl, max_bytes=max_bytes)
+
+
+def get(url, headers=None, session=None, cache=None):
+    """GETs url through the cache when one is given, otherwise straight through requests."""
+    if cache is not None:
+        return cache.get(url, headers=headers, session=session)
+    return (session or requests).get(url, headers=headers)
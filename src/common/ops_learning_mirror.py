@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import uuid
+import logging
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+
+
+MIRROR_DIR_ENV = "OPS_LEARNING_MIRROR_DIR"
+MIRROR_TTL_ENV = "OPS_LEARNING_MIRROR_TTL"
+DEFAULT_TTL = 300
+GO_API_URL = "https://goadmin.ifrc.org/api/v2/"
+PAGE_LIMIT = 200
+FETCH_MAX_WORKERS = 8
+
+# fields of the ops-learning table the local filter engine knows, as stored in the mirror
+LEARNING_FIELDS = ['id', 'appeal_code', 'learning', 'learning_validated', 'is_validated', 'type', 'type_validated',
+                   'organization', 'organization_validated', 'sector', 'sector_validated', 'per_component',
+                   'per_component_validated', 'created_at', 'modified_at']
+# fields holding several related ids, a filter on them matches when any of the ids matches
+LIST_FIELDS = ['sector', 'sector_validated', 'per_component', 'per_component_validated']
+# appeal fields reachable with appeal_code__<field> filters, and the mirror column holding them
+APPEAL_FILTER_COLUMNS = {
+    'code': 'appeal_code',
+    'atype': 'atype',
+    'country': 'country_id',
+    'region': 'region_id',
+    'dtype': 'dtype_id',
+    'start_date': 'start_date',
+    'end_date': 'end_date',
+    'num_beneficiaries': 'num_beneficiaries',
+}
+DATE_COLUMNS = ['start_date', 'end_date', 'created_at', 'modified_at']
+# columns the search filter looks into, case insensitive
+SEARCH_COLUMNS = ['learning_validated', 'learning', 'appeal_code', 'appeal_name']
+LOOKUPS = ['exact', 'in', 'gt', 'gte', 'lt', 'lte', 'icontains']
+
+
+class UnsupportedFilterError(ValueError):
+    """A request filter key the local filter engine cannot evaluate, the query has to go to GO."""
+
+
+def related_id(value):
+    """Id of a related object, whether GO nests the object or only gives its id; lists stay lists."""
+    if isinstance(value, list):
+        return [related_id(x) for x in value]
+    if isinstance(value, dict):
+        return value.get('id', value.get('code'))
+    return value
+
+
+def related_name(value, keys):
+    if isinstance(value, dict):
+        for key in keys:
+            if value.get(key) is not None:
+                return value[key]
+    return None
+
+
+def flatten_learning(record):
+    appeal = record.get('appeal_code', record.get('appeal'))
+    row = {field: related_id(record.get(field)) for field in LEARNING_FIELDS}
+    row['appeal_code'] = appeal.get('code') if isinstance(appeal, dict) else appeal
+    row['is_validated'] = bool(record.get('is_validated'))
+    for field in LIST_FIELDS:
+        row[field] = row[field] or []
+    return row
+
+
+def flatten_appeal(record):
+    country, region, dtype = record.get('country'), record.get('region'), record.get('dtype')
+    return {
+        'appeal_id': record.get('id'),
+        'appeal_code': record.get('code'),
+        'appeal_name': record.get('name'),
+        'atype': related_id(record.get('atype')),
+        'start_date': record.get('start_date'),
+        'end_date': record.get('end_date'),
+        'num_beneficiaries': record.get('num_beneficiaries'),
+        'country_id': related_id(country),
+        'country_name': related_name(country, ['name']),
+        'region_id': related_id(region) if region is not None else related_name(country, ['region']),
+        'region_name': related_name(region, ['region_name', 'name']),
+        'dtype_id': related_id(dtype),
+        'dtype_name': related_name(dtype, ['name']),
+        'modified_at': record.get('modified_at'),
+    }
+
+
+def filter_values(value):
+    """Values of an __in filter: a list, or a comma separated string as GO takes it in the URL."""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [x.strip() for x in str(value).split(',') if x.strip()]
+
+
+def coerce_value(series, value, list_field=False):
+    """A filter value, given as text in the request filter, as the type of the column it is compared to."""
+    if series.dtype == bool:
+        return str(value).lower() in ('true', '1')
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.to_datetime(value, utc=True)
+    if list_field or pd.api.types.is_numeric_dtype(series):
+        try:
+            return pd.to_numeric(value)
+        except (ValueError, TypeError):
+            return value
+    return str(value)
+
+
+def filter_column(key, path):
+    if len(path) == 1 and path[0] in LEARNING_FIELDS:
+        return path[0]
+    if len(path) == 2 and path[0] == 'appeal_code' and path[1] in APPEAL_FILTER_COLUMNS:
+        return APPEAL_FILTER_COLUMNS[path[1]]
+    raise UnsupportedFilterError(f"Filter {key} is not supported by the local ops-learning mirror")
+
+
+def key_column(key):
+    """Column and lookup of a Django-style filter key, e.g. appeal_code__country__in gives ('country_id', 'in')."""
+    path = key.split('__')
+    lookup = path.pop() if len(path) > 1 and path[-1] in LOOKUPS else 'exact'
+    return filter_column(key, path), lookup
+
+
+def compare(series, lookup, values):
+    if lookup in ('exact', 'in'):
+        return series.isin(values)
+    if lookup == 'icontains':
+        return series.astype('string').str.contains(str(values[0]), case=False, regex=False, na=False)
+    operator = {'gt': series.gt, 'gte': series.ge, 'lt': series.lt, 'lte': series.le}[lookup]
+    return operator(values[0]).fillna(False).astype(bool)
+
+
+def search_terms(value):
+    """Terms of a search filter as GO's DRF SearchFilter splits it: on whitespace and commas."""
+    value = str(value).replace('\x00', '')
+    if '"' in value or "'" in value:
+        # DRF keeps quoted phrases together, left to GO rather than approximated
+        raise UnsupportedFilterError("Filter search with quoted phrases is not supported by the local ops-learning mirror")
+    return value.replace(',', ' ').split()
+
+
+def key_mask(df, key, value):
+    """Rows of df matching one Django-style filter key, as GO's ops-learning filters evaluate it."""
+    if key == 'search':
+        # every term has to be found in at least one of the search columns
+        mask = np.ones(len(df), dtype=bool)
+        for term in search_terms(value):
+            term_mask = np.zeros(len(df), dtype=bool)
+            for column in SEARCH_COLUMNS:
+                if column in df.columns:
+                    term_mask |= df[column].astype('string').str.contains(term, case=False, regex=False, na=False).to_numpy()
+            mask &= term_mask
+        return mask
+
+    column, lookup = key_column(key)
+    if column not in df.columns:
+        raise UnsupportedFilterError(f"Filter {key} needs the {column} column, which the learnings do not have")
+    series = df[column].reset_index(drop=True)
+    list_field = column in LIST_FIELDS
+    if list_field:
+        # one row per related id, a learning matches when any of its ids does
+        series = series.explode()
+    values = filter_values(value) if lookup == 'in' else [value]
+    values = [coerce_value(series, x, list_field) for x in values]
+    matches = compare(series, lookup, values)
+    if list_field:
+        matches = matches.groupby(level=0).any().reindex(range(len(df)), fill_value=False)
+    return matches.to_numpy(dtype=bool)
+
+
+def filter_mask(df, request_filter):
+    """Rows of df matching every non-empty key of request_filter.
+
+    Raises UnsupportedFilterError for keys the local engine does not know, so callers
+    can send those queries to GO instead.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for key, value in request_filter.items():
+        if value:
+            mask &= key_mask(df, key, value)
+    return mask
+
+
+class OpsLearningMirror:
+    """Local columnar copy of the GO ops-learning table, joined with the fields of its appeals.
+
+    Learnings and appeals are stored as Parquet files and synced incrementally:
+    only the rows modified since the stored watermark are downloaded, and they
+    replace their previous version by id. When GO reports another number of rows
+    than the local copy has (rows were deleted, or GO ignored the modified_at
+    filter), the table is downloaded again in full. The PER component and sector
+    titles are small and downloaded on every sync. The state file, with the
+    watermarks, is written after the tables, so an interrupted sync only downloads
+    again. Syncs closer than the TTL to the previous one are skipped.
+    """
+
+    def __init__(self, mirror_dir, headers=None, ttl=DEFAULT_TTL, max_workers=FETCH_MAX_WORKERS):
+        self.mirror_dir = mirror_dir
+        self.headers = headers
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.session = None
+        self._learnings = None
+        os.makedirs(mirror_dir, exist_ok=True)
+
+    def _path(self, table):
+        return os.path.join(self.mirror_dir, table + '.parquet')
+
+    def _state_path(self):
+        return os.path.join(self.mirror_dir, 'state.json')
+
+    def _read_state(self):
+        try:
+            with open(self._state_path()) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _fetch_json(self, url):
+        response = (self.session or requests).get(url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_rows(self, table, params=''):
+        """Rows of every page of a GO table; the first page gives the count, the others are fetched concurrently."""
+        url = f"{GO_API_URL}{table}/?limit={PAGE_LIMIT}{params}"
+        first_page = self._fetch_json(url)
+        rows = list(first_page['results'])
+        offsets = range(PAGE_LIMIT, first_page['count'], PAGE_LIMIT)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for page in pool.map(lambda offset: self._fetch_json(f"{url}&offset={offset}"), offsets):
+                rows.extend(page['results'])
+        return rows
+
+    def _sync_table(self, table, key, flatten, watermark):
+        """(rows, number of changed rows) of a GO table, merged into the local copy since watermark."""
+        local = None
+        if watermark is not None and os.path.exists(self._path(table)):
+            local = pd.read_parquet(self._path(table))
+
+        params = '' if local is None else '&modified_at__gte=' + quote(watermark)
+        changed = pd.DataFrame([flatten(x) for x in self._fetch_rows(table, params)])
+        if local is None:
+            return changed, len(changed)
+
+        if not changed.empty:
+            # a row edited since the last sync replaces its previous version
+            local = pd.concat([local, changed], ignore_index=True).drop_duplicates(subset=key, keep='last')
+        total_count = self._fetch_json(f"{GO_API_URL}{table}/?limit=1")['count']
+        if len(local) != total_count:
+            logging.info(f"Local {table} has {len(local)} rows, GO {total_count}: downloading it again")
+            return self._sync_table(table, key, flatten, None)
+        return local.reset_index(drop=True), len(changed)
+
+    def _fetch_labels(self):
+        """Titles of the PER components and sectors, by id."""
+        per_components = self._fetch_rows('per-formcomponent')
+        sectors = self._fetch_json(GO_API_URL + 'primarysector')
+        return {
+            'per_component': {str(x['id']): x['title'] for x in per_components},
+            'sector': {str(x['key']): x['label'] for x in sectors},
+        }
+
+    def sync(self, force=False):
+        """Brings the local copy up to date with GO; returns False when skipped because of the TTL."""
+        state = self._read_state()
+        if not force and time.time() - state.get('synced_at', 0) < self.ttl:
+            return False
+
+        start_time = time.time()
+        watermarks = state.get('watermarks', {})
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        try:
+            learnings, nb_learnings = self._sync_table('ops-learning', 'id', flatten_learning, watermarks.get('ops-learning'))
+            appeals, nb_appeals = self._sync_table('appeal', 'appeal_id', flatten_appeal, watermarks.get('appeal'))
+            labels = self._fetch_labels()
+        finally:
+            self.session.close()
+            self.session = None
+
+        for table, df in [('ops-learning', learnings), ('appeal', appeals)]:
+            self._write_atomic(self._path(table), df.to_parquet(index=False))
+            # the modified_at of the newest row, rows changed at that time are downloaded again next time
+            watermarks[table] = df['modified_at'].max() if 'modified_at' in df.columns and df['modified_at'].notna().any() else None
+
+        state = {'watermarks': watermarks, 'labels': labels, 'synced_at': time.time()}
+        self._write_atomic(self._state_path(), json.dumps(state).encode('utf8'))
+        self._learnings = None
+        logging.info(f"Ops-learning mirror synced in {time.time() - start_time:.1f} s: {nb_learnings} learnings "
+                     f"and {nb_appeals} appeals changed, {len(learnings)} learnings in the mirror")
+        return True
+
+    def is_empty(self):
+        return not os.path.exists(self._path('ops-learning'))
+
+    def learnings(self):
+        """Mirrored learnings joined with the fields of their appeals, one row per learning."""
+        if self._learnings is None:
+            learnings = pd.read_parquet(self._path('ops-learning'))
+            appeals = pd.read_parquet(self._path('appeal'))
+            if 'appeal_code' in learnings.columns and 'appeal_code' in appeals.columns:
+                appeals = appeals.drop(columns=['appeal_id', 'modified_at'], errors='ignore').drop_duplicates('appeal_code', keep='last')
+                learnings = learnings.merge(appeals, on='appeal_code', how='left')
+            for column in DATE_COLUMNS:
+                if column in learnings.columns:
+                    learnings[column] = pd.to_datetime(learnings[column], utc=True, errors='coerce', format='ISO8601')
+            if 'start_date' in learnings.columns:
+                learnings['appeal_year'] = learnings['start_date'].dt.year.astype('Int64')
+            self._learnings = learnings
+        return self._learnings
+
+    def appeal_codes(self):
+        """Codes of the appeals that have learnings in GO."""
+        return self.learnings()[['appeal_code']]
+
+    def query(self, request_filter):
+        """Learnings matching request_filter, with the columns of the GO ops-learning CSV export.
+
+        The validated learning, PER components and sectors are used for validated
+        learnings, and there is one row per component and sector, as in the export.
+        """
+        learnings = self.learnings()
+        learnings = learnings[filter_mask(learnings, request_filter)]
+        labels = self._read_state().get('labels', {})
+
+        def titles(field, lookup):
+            validated, unvalidated = learnings[field + '_validated'], learnings[field]
+            return [[lookup.get(str(x), x) for x in (v if is_validated else u)] or [None]
+                    for v, u, is_validated in zip(validated, unvalidated, learnings['is_validated'])]
+
+        export = pd.DataFrame({
+            'id': learnings['id'],
+            'appeal_code': learnings['appeal_code'],
+            'learning': learnings['learning_validated'].where(learnings['is_validated'], learnings['learning']),
+            'component': titles('per_component', labels.get('per_component', {})),
+            'sector': titles('sector', labels.get('sector', {})),
+        })
+        for column in ['country_id', 'country_name', 'region_id', 'region_name', 'dtype_name', 'appeal_name', 'appeal_year', 'modified_at']:
+            if column in learnings.columns:
+                export[column] = learnings[column]
+        return export.explode('component').explode('sector').sort_values('id', kind='stable').reset_index(drop=True)
+
+
+def from_env(headers=None):
+    """Returns an OpsLearningMirror when OPS_LEARNING_MIRROR_DIR is set, otherwise None (mirror disabled)."""
+    mirror_dir = os.getenv(MIRROR_DIR_ENV)
+    if not mirror_dir:
+        return None
+    ttl = float(os.getenv(MIRROR_TTL_ENV, DEFAULT_TTL))
+    return OpsLearningMirror(mirror_dir, headers=headers, ttl=ttl)
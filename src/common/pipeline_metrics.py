@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import requests
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is then not reported
+    resource = None
+
+METRICS_DIR = "metrics"
+PROMETHEUS_PREFIX = "go_learnings"
+
+
+def peak_rss_bytes():
+    '''peak resident set size of the process so far'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    '''resets the peak RSS of the process (VmHWM, and ru_maxrss with it); False where it cannot (not Linux)'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes_since_reset():
+    '''VmHWM of /proc/self/status: the peak RSS since reset_peak_rss()'''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class HttpCounter:
+    '''Counts the requests sent through requests.Session, from every thread, and their bytes.
+
+    Session.send is wrapped while the counter is installed, so every HTTP call of the
+    job is counted without changing its code.
+    Response bytes are the Content-Length, or the body length when it is already read.
+    '''
+
+    def __init__(self):
+        self.requests = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.lock = threading.Lock()
+        self.original_send = None
+
+    def install(self):
+        if self.original_send is not None:
+            return
+        self.original_send = original_send = requests.Session.send
+        counter = self
+
+        def send(session, request, **kwargs):
+            response = original_send(session, request, **kwargs)
+            body = request.body or b''
+            length = response.headers.get('Content-Length')
+            if length is None and not kwargs.get('stream'):
+                length = len(response.content)
+            with counter.lock:
+                counter.requests += 1
+                counter.request_bytes += len(body)
+                counter.response_bytes += int(length or 0)
+            return response
+
+        requests.Session.send = send
+
+    def uninstall(self):
+        if self.original_send is not None:
+            requests.Session.send = self.original_send
+            self.original_send = None
+
+    def snapshot(self):
+        with self.lock:
+            return self.requests, self.request_bytes, self.response_bytes
+
+
+class StageMetrics:
+    '''what one stage did; rows_in and rows_out are set by the stage'''
+
+    def __init__(self, name, rows_in = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.status = 'running'
+        self.values = {}
+
+    def as_dict(self):
+        return dict({'stage': self.name, 'status': self.status, 'rows_in': self.rows_in, 'rows_out': self.rows_out}, **self.values)
+
+
+class RunMetrics:
+    '''Wall time, HTTP requests and bytes, rows in/out and peak RSS of every stage of a job run.
+
+    At the end of run() the metrics are written to <metrics_dir>/<job>-<start time>.json,
+    and, with a prometheus_dir, to <prometheus_dir>/<job>.prom for the node exporter
+    textfile collector. Both files are replaced atomically.
+    The peak RSS of a stage is its own peak, read from /proc on Linux and not reported
+    elsewhere; the peak RSS of the run is the peak of the whole process.
+    '''
+
+    def __init__(self, job, metrics_dir = METRICS_DIR, prometheus_dir = None):
+        self.job = job
+        self.metrics_dir = metrics_dir
+        self.prometheus_dir = prometheus_dir
+        self.http = HttpCounter()
+        self.stages = []
+        self.started_at = time.time()
+        self.status = 'running'
+        self.peak_rss = None
+
+    @contextmanager
+    def run(self):
+        self.http.install()
+        start = time.perf_counter()
+        try:
+            yield self
+            self.status = 'success'
+        except BaseException:
+            self.status = 'failed'
+            raise
+        finally:
+            self.duration = time.perf_counter() - start
+            self.http.uninstall()
+            self.write()
+
+    @contextmanager
+    def stage(self, name, rows_in = None):
+        stage = StageMetrics(name, rows_in)
+        self.stages.append(stage)
+        requests_before, sent_before, received_before = self.http.snapshot()
+        # the process peak would report the largest earlier stage, so the peak is reset per stage,
+        # once the run has recorded it: on Linux ru_maxrss is reset with it
+        self.record_peak_rss()
+        peak_reset = reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield stage
+            stage.status = 'success'
+        except BaseException:
+            stage.status = 'failed'
+            raise
+        finally:
+            requests_after, sent_after, received_after = self.http.snapshot()
+            stage.values = {
+                'duration_seconds': round(time.perf_counter() - start, 3),
+                'http_requests': requests_after - requests_before,
+                'http_request_bytes': sent_after - sent_before,
+                'http_response_bytes': received_after - received_before,
+                'peak_rss_bytes': peak_rss_bytes_since_reset() if peak_reset else None,
+            }
+            logging.info('Stage %s: %s in %.1f s, %s HTTP requests, %s rows in, %s rows out', name, stage.status,
+                         stage.values['duration_seconds'], stage.values['http_requests'], stage.rows_in, stage.rows_out)
+
+    def record_peak_rss(self):
+        peak = peak_rss_bytes()
+        if peak is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak)
+
+    def as_dict(self):
+        self.record_peak_rss()
+        requests_total, sent, received = self.http.snapshot()
+        return {
+            'job': self.job,
+            'status': self.status,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+            'duration_seconds': round(self.duration, 3),
+            'http_requests': requests_total,
+            'http_request_bytes': sent,
+            'http_response_bytes': received,
+            'peak_rss_bytes': self.peak_rss,
+            'stages': [x.as_dict() for x in self.stages],
+        }
+
+    def prometheus_lines(self, metrics):
+        '''textfile collector exposition: every metric is a gauge of the last run'''
+        samples = {}
+        run_labels = f'job="{self.job}"'
+        for name, value in [('run_success', int(metrics['status'] == 'success')), ('run_timestamp_seconds', round(self.started_at)),
+                            ('run_duration_seconds', metrics['duration_seconds']), ('run_peak_rss_bytes', metrics['peak_rss_bytes'])]:
+            samples.setdefault(name, []).append((run_labels, value))
+        for stage in metrics['stages']:
+            stage_labels = f'job="{self.job}",stage="{stage["stage"]}"'
+            for name in ['duration_seconds', 'http_requests', 'http_request_bytes', 'http_response_bytes', 'rows_in', 'rows_out', 'peak_rss_bytes']:
+                samples.setdefault('stage_' + name, []).append((stage_labels, stage[name]))
+
+        lines = []
+        for name, values in samples.items():
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge')
+            lines.extend(f'{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value}' for labels, value in values if value is not None)
+        return lines
+
+    def write(self):
+        metrics = self.as_dict()
+        os.makedirs(self.metrics_dir, exist_ok = True)
+        path = os.path.join(self.metrics_dir, self.job + '-' + time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.started_at)) + '.json')
+        write_atomic(path, json.dumps(metrics, indent = 2))
+        logging.info('Run metrics written to %s', path)
+
+        if self.prometheus_dir:
+            write_atomic(os.path.join(self.prometheus_dir, self.job + '.prom'), '\n'.join(self.prometheus_lines(metrics)) + '\n')
+
+
+def write_atomic(path, text):
+    with open(path + '.tmp', 'w') as output_file:
+        output_file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def from_env(job):
+    '''RunMetrics configured by METRICS_DIR and PROMETHEUS_TEXTFILE_DIR'''
+    return RunMetrics(job, os.getenv('METRICS_DIR', METRICS_DIR), os.getenv('PROMETHEUS_TEXTFILE_DIR'))
@@ -0,0 +1,69 @@
+import sys
+import time
+import logging
+import numpy as np
+import pandas as pd
+from extract_tag_go_learnings import filter_final_report
+
+# sizes of the synthetic appeal table; final reports and ops learnings scale with it
+APPEAL_SIZES = [10_000, 100_000, 1_000_000]
+# the list-scan implementation is quadratic, only compare against it on small tables
+LEGACY_MAX_APPEALS = 10_000
+
+
+def legacy_filter_final_report(final_report, appeal, ops_learning):
+    '''filter_final_report before indexing, kept as reference for equality and timings'''
+    mask = [x for x in final_report['is_published']]
+    final_report = final_report[mask]
+    mask = [x in list(appeal['code']) for x in final_report['appeal_code']]
+    final_report = final_report[mask]
+    list_new_reports = np.setdiff1d(final_report['appeal_code'].unique(),ops_learning['appeal_code'].unique())
+    mask = [x in list_new_reports for x in final_report['appeal_code']]
+    final_report = final_report[mask]
+    return final_report[['appeal_code','planned_interventions']]
+
+
+def make_tables(nb_appeals, seed=0):
+    '''synthetic GO tables: half of the appeals have a final report, a quarter are already in ops learning'''
+    rng = np.random.default_rng(seed)
+    codes = np.array([f'MDR{i:07d}' for i in range(nb_appeals)], dtype=object)
+
+    # silent appeals are missing from the public appeal table
+    appeal = pd.DataFrame({'code': codes[rng.random(nb_appeals) < 0.8]})
+
+    report_codes = rng.choice(codes, size=nb_appeals // 2, replace=False)
+    final_report = pd.DataFrame({
+        'appeal_code': report_codes,
+        'is_published': rng.random(len(report_codes)) < 0.7,
+        'planned_interventions': [[] for _ in range(len(report_codes))],
+    })
+
+    ops_learning = pd.DataFrame({'appeal_code': rng.choice(codes, size=nb_appeals // 4)})
+    return final_report, appeal, ops_learning
+
+
+def run(appeal_sizes):
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"{'appeals':>10} {'reports':>10} {'kept':>8} {'indexed (s)':>12} {'legacy (s)':>11}")
+    for nb_appeals in appeal_sizes:
+        final_report, appeal, ops_learning = make_tables(nb_appeals)
+
+        start = time.perf_counter()
+        filtered = filter_final_report(final_report, appeal, ops_learning)
+        indexed_time = time.perf_counter() - start
+
+        legacy_time = float('nan')
+        if nb_appeals <= LEGACY_MAX_APPEALS:
+            start = time.perf_counter()
+            legacy = legacy_filter_final_report(final_report, appeal, ops_learning)
+            legacy_time = time.perf_counter() - start
+            pd.testing.assert_frame_equal(filtered, legacy)
+
+        print(f"{nb_appeals:>10} {len(final_report):>10} {len(filtered):>8} {indexed_time:>12.3f} {legacy_time:>11.3f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run([int(x) for x in sys.argv[1:]])
+    else:
+        run(APPEAL_SIZES)
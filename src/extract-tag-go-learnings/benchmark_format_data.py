@@ -0,0 +1,106 @@
+import sys
+import time
+import logging
+import tracemalloc
+import numpy as np
+import pandas as pd
+from extract_tag_go_learnings import format_data, manage_duplicates, MAPPING_PER, MAPPING_SECTOR
+
+EXCERPT_SIZES = [10_000, 100_000, 1_000_000]
+# distinct excerpts per appeal; every excerpt is tagged several times, as after split_rows on real reports
+EXCERPTS_PER_APPEAL = 20
+NB_APPEALS_RATIO = 50
+
+
+def legacy_format_data(df, mapping_per, dict_per, mapping_sector, dict_sector, dict_org, dict_finding):
+    '''format_data before the categorical columns, kept as reference for equality and timings'''
+    df.loc[:,'mapped_per'] = [mapping_per[x] if pd.notna(x) else None for x in df['PER - Component']]
+    df.loc[:,'id_per'] = [dict_per[x] if pd.notna(x) else None for x in df['mapped_per']]
+    df.loc[:,'mapped_sector'] = [mapping_sector[x] if pd.notna(x) else None for x in df['Sector']]
+    df.loc[:,'id_sector'] = [dict_sector[x] if pd.notna(x) else None for x in df['mapped_sector']]
+    df.loc[:,'id_institution'] =  [dict_org[x] for x in df['Institution']]
+    df.loc[:,'id_finding'] = [dict_finding[x] for x in df['Finding']]
+    return df[['appeal_code', 'Excerpts', 'id_per','id_sector','id_institution','id_finding']]
+
+
+def legacy_manage_duplicates(df):
+    '''manage_duplicates before the group-code aggregation'''
+    df = df.groupby(['appeal_code','Excerpts','id_finding'], as_index = False).agg(list).reset_index()
+    df.drop(columns = ['index'], inplace = True)
+    df['id_per'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_per']]
+    df['id_sector'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_sector']]
+    df['id_institution'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_institution']]
+    return df
+
+
+def make_reference_data():
+    '''synthetic GO ids for every title the mappings point to'''
+    dict_per = {x: i + 1 for i, x in enumerate(sorted({x for x in MAPPING_PER.values() if x}))}
+    dict_sector = {x: i + 1 for i, x in enumerate(sorted({x for x in MAPPING_SECTOR.values() if x}))}
+    dict_org = {'Secretariat': 1, 'National Society': 2}
+    dict_finding = {'Lessons Learnt': 1, 'Challenges': 2}
+    return MAPPING_PER, dict_per, MAPPING_SECTOR, dict_sector, dict_org, dict_finding
+
+
+def make_tagged_data(nb_excerpts, seed=0):
+    '''synthetic tag_data output: every distinct excerpt appears with several sectors and PER components'''
+    rng = np.random.default_rng(seed)
+    nb_appeals = max(1, nb_excerpts // NB_APPEALS_RATIO)
+    appeals = rng.integers(nb_appeals, size=nb_excerpts)
+    per_labels = np.array(list(MAPPING_PER) + [None], dtype=object)
+    return pd.DataFrame({
+        'appeal_code': [f'MDR{x:05d}' for x in appeals],
+        'Excerpts': [f'Timely procurement of item {x} was a challenge in appeal {y}.' for x, y in zip(rng.integers(EXCERPTS_PER_APPEAL, size=nb_excerpts), appeals)],
+        'Sector': rng.choice(np.array(list(MAPPING_SECTOR), dtype=object), size=nb_excerpts),
+        'Finding': rng.choice(np.array(['Lessons Learnt', 'Challenges'], dtype=object), size=nb_excerpts),
+        'PER - Component': rng.choice(per_labels, size=nb_excerpts),
+        'Institution': rng.choice(np.array(['Secretariat', 'National Society'], dtype=object), size=nb_excerpts),
+    })
+
+
+def measure(function, df):
+    '''result, seconds and peak traced memory in MB; tracing slows python code down, so it gets its own run'''
+    start = time.perf_counter()
+    result = function(df.copy())
+    elapsed = time.perf_counter() - start
+
+    df = df.copy()
+    tracemalloc.start()
+    function(df)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def assert_equivalent(deduplicated, legacy):
+    '''same groups in the same order, same sets of ids'''
+    assert list(deduplicated.columns) == list(legacy.columns)
+    assert len(deduplicated) == len(legacy)
+    for column in ['appeal_code', 'Excerpts', 'id_finding']:
+        assert list(deduplicated[column]) == list(legacy[column]), column
+    for column in ['id_per', 'id_sector', 'id_institution']:
+        assert list(deduplicated[column]) == [sorted(x) for x in legacy[column]], column
+
+
+def run(excerpt_sizes, legacy = True):
+    logging.getLogger().setLevel(logging.WARNING)
+    reference_data = make_reference_data()
+    print(f"{'excerpts':>10} {'learnings':>10} {'columnar (s)':>13} {'peak (MB)':>10} {'legacy (s)':>11} {'peak (MB)':>10}")
+    for nb_excerpts in excerpt_sizes:
+        tagged = make_tagged_data(nb_excerpts)
+
+        deduplicated, elapsed, peak = measure(lambda df: manage_duplicates(format_data(df, *reference_data)), tagged)
+
+        legacy_elapsed, legacy_peak = float('nan'), float('nan')
+        if legacy:
+            legacy_deduplicated, legacy_elapsed, legacy_peak = measure(lambda df: legacy_manage_duplicates(legacy_format_data(df, *reference_data)), tagged)
+            assert_equivalent(deduplicated, legacy_deduplicated)
+
+        print(f"{nb_excerpts:>10} {len(deduplicated):>10} {elapsed:>13.2f} {peak:>10.0f} {legacy_elapsed:>11.2f} {legacy_peak:>10.0f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run([int(x) for x in sys.argv[1:]])
+    else:
+        run(EXCERPT_SIZES)
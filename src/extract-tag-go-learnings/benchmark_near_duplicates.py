@@ -0,0 +1,72 @@
+import sys
+import time
+import logging
+import numpy as np
+import pandas as pd
+from near_duplicates import collapse_near_duplicates, normalize_text, NEAR_DUPLICATE_THRESHOLD, SHINGLE_SIZE
+
+EXCERPT_SIZES = [10_000, 100_000, 300_000]
+EXCERPTS_PER_APPEAL = 40
+# share of the excerpts that are an edited copy of another excerpt of the same appeal
+NEAR_COPY_RATE = 0.3
+# the all-pairs comparison is quadratic, only check recall against it on small inputs
+EXACT_MAX_EXCERPTS = 10_000
+VOCABULARY = [f'word{i}' for i in range(5000)]
+
+
+def make_learnings(nb_excerpts, seed=0):
+    '''synthetic split_rows output where some excerpts are copies with one word, spacing or punctuation changed'''
+    rng = np.random.default_rng(seed)
+    excerpts = []
+    for i in range(nb_excerpts):
+        if i % EXCERPTS_PER_APPEAL and rng.random() < NEAR_COPY_RATE:
+            words = excerpts[i - 1 - rng.integers(i % EXCERPTS_PER_APPEAL)].split(' ')
+            words[rng.integers(len(words))] = VOCABULARY[rng.integers(len(VOCABULARY))]
+            excerpts.append(' '.join(words) + rng.choice(['', '.', ' ']))
+        else:
+            excerpts.append(' '.join(rng.choice(VOCABULARY, size=25)))
+    return pd.DataFrame({
+        'appeal_code': [f'MDR{i // EXCERPTS_PER_APPEAL:05d}' for i in range(nb_excerpts)],
+        'Sector': 'Health',
+        'Finding': 'Challenges',
+        'Excerpts': excerpts,
+    })
+
+
+def jaccard(first, second):
+    first, second = [normalize_text(x).ljust(SHINGLE_SIZE) for x in (first, second)]
+    first, second = [{x[i:i+SHINGLE_SIZE] for i in range(len(x) - SHINGLE_SIZE + 1)} for x in (first, second)]
+    return len(first & second) / len(first | second)
+
+
+def exact_recall(learnings, collapsed, threshold):
+    '''share of the pairs above threshold (all-pairs, per appeal) that ended in the same cluster'''
+    found, total = 0, 0
+    for _, appeal in learnings.groupby('appeal_code'):
+        for i in range(len(appeal)):
+            for j in range(i + 1, len(appeal)):
+                if jaccard(appeal['Excerpts'].iloc[i], appeal['Excerpts'].iloc[j]) >= threshold:
+                    total += 1
+                    found += collapsed['Excerpts'].loc[appeal.index[i]] == collapsed['Excerpts'].loc[appeal.index[j]]
+    return found / total if total else float('nan')
+
+
+def run(excerpt_sizes, threshold = NEAR_DUPLICATE_THRESHOLD):
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"{'excerpts':>10} {'distinct after':>15} {'time (s)':>9} {'excerpts/s':>11} {'recall':>7}")
+    for nb_excerpts in excerpt_sizes:
+        learnings = make_learnings(nb_excerpts)
+
+        start = time.perf_counter()
+        collapsed = collapse_near_duplicates(learnings, threshold)
+        elapsed = time.perf_counter() - start
+
+        recall = exact_recall(learnings, collapsed, threshold) if nb_excerpts <= EXACT_MAX_EXCERPTS else float('nan')
+        print(f"{nb_excerpts:>10} {collapsed['Excerpts'].nunique():>15} {elapsed:>9.2f} {nb_excerpts / elapsed:>11.0f} {recall:>7.3f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run([int(x) for x in sys.argv[1:]])
+    else:
+        run(EXCERPT_SIZES)
@@ -0,0 +1,74 @@
+import sys
+import time
+import logging
+import numpy as np
+import pandas as pd
+from nltk.tokenize import LineTokenizer
+from extract_tag_go_learnings import split_excerpts
+
+# number of lines in the synthetic corpus
+NB_LINES = 300_000
+
+BULLETS = ['•\t', '- ', '-', '• ', '▪ ', ' ', '', '', '']
+SENTENCES = [
+    'Timely procurement was a challenge due to market disruption.',
+    'Volunteers were mobilised quickly thanks to the branch network.',
+    'Coordination with local authorities improved the targeting.',
+    'N/A',
+    'None',
+    '',
+    '   ',
+]
+
+
+def legacy_split_excerpts(df):
+    '''split_excerpts before vectorization, kept as reference for equality and timings'''
+    df['Excerpts_ind'] = [LineTokenizer(blanklines='discard').tokenize(x) for x in df['Excerpts']]
+    df = df.explode(column = 'Excerpts_ind', ignore_index = True)
+    df.drop(columns = 'Excerpts', inplace =True)
+    df['Excerpts_ind'] = [np.nan if pd.notna(x) and len(x) < 5 else x for x in df['Excerpts_ind']]
+    df = df[pd.notna(df['Excerpts_ind'])]
+    df['Excerpts_ind'] = [x[2:] if x.startswith('•\t') else x for x in df['Excerpts_ind']]
+    df['Excerpts_ind'] = [x[1:] if x.startswith(tuple(['-','•','▪',' '])) else x for x in df['Excerpts_ind']]
+    df['Excerpts'] = [x.strip() for x in df['Excerpts_ind']]
+    df.drop(columns = 'Excerpts_ind', inplace =True)
+    return df
+
+
+def make_corpus(nb_lines, seed=0):
+    '''planned interventions whose texts add up to nb_lines bullet lines'''
+    rng = np.random.default_rng(seed)
+    texts = []
+    total = 0
+    while total < nb_lines:
+        nb = int(rng.integers(1, 8))
+        separator = ['\n', '\r\n', '\n\n'][int(rng.integers(0, 3))]
+        texts.append(separator.join(BULLETS[int(rng.integers(0, len(BULLETS)))] + SENTENCES[int(rng.integers(0, len(SENTENCES)))] for _ in range(nb)))
+        total += nb
+    return pd.DataFrame({
+        'appeal_code': [f'MDR{i // 4:05d}' for i in range(len(texts))],
+        'Sector': 'Health',
+        'Finding': 'Lessons Learnt',
+        'Excerpts': texts,
+    })
+
+
+def run(nb_lines):
+    logging.getLogger().setLevel(logging.WARNING)
+    corpus = make_corpus(nb_lines)
+
+    start = time.perf_counter()
+    legacy = legacy_split_excerpts(corpus.copy())
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = split_excerpts(corpus)
+    vectorized_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(vectorized.reset_index(drop = True), legacy.reset_index(drop = True))
+    print(f"{nb_lines} lines in {len(corpus)} texts -> {len(vectorized)} excerpts (identical)")
+    print(f"legacy: {legacy_time:.3f} s, vectorized: {vectorized_time:.3f} s, speed-up: {legacy_time / vectorized_time:.1f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else NB_LINES)
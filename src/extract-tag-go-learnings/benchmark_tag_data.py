@@ -0,0 +1,52 @@
+import sys
+import time
+import logging
+import pandas as pd
+from extract_tag_go_learnings import tag_data
+from classify_stub_server import start_server
+
+NB_EXCERPTS = 500
+BATCH_SIZES = [1, 8, 32, 128]
+# None is the serial path, the others go through the asyncio path
+CONCURRENCY_LEVELS = [None, 8]
+# the stub rejects bigger requests, to exercise the split-and-retry path
+STUB_MAX_BATCH_SIZE = 64
+# share of requests the stub answers with 429/503, to exercise the backoff
+STUB_ERROR_RATE = 0.05
+
+
+def make_learnings(nb_excerpts):
+    return pd.DataFrame({
+        'appeal_code': [f'MDR{i // 10:05d}' for i in range(nb_excerpts)],
+        'Sector': 'Health',
+        'Finding': 'Challenges',
+        'Excerpts': [f'Timely procurement of item {i} was a challenge.' for i in range(nb_excerpts)],
+    })
+
+
+def run(nb_excerpts, batch_sizes):
+    logging.getLogger().setLevel(logging.WARNING)
+    server, url = start_server(max_batch_size=STUB_MAX_BATCH_SIZE)
+    flaky_server, flaky_url = start_server(max_batch_size=STUB_MAX_BATCH_SIZE, error_rate=STUB_ERROR_RATE)
+    learnings = make_learnings(nb_excerpts)
+
+    reference = None
+    for concurrency in CONCURRENCY_LEVELS:
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            # the serial path has no retries, only the asyncio path is pointed at the flaky stub
+            tagged = tag_data(learnings.copy(), 'PER - Component', flaky_url if concurrency else url, batch_size=batch_size, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+
+            if reference is None:
+                reference = tagged
+            pd.testing.assert_frame_equal(tagged, reference)
+            print(f"concurrency {str(concurrency):>4}, batch size {batch_size:>4}: {elapsed:7.2f} s, {nb_excerpts / elapsed:8.1f} excerpts/s")
+    server.shutdown()
+    flaky_server.shutdown()
+
+
+if __name__ == "__main__":
+    nb_excerpts = int(sys.argv[1]) if len(sys.argv) > 1 else NB_EXCERPTS
+    batch_sizes = [int(x) for x in sys.argv[2:]] or BATCH_SIZES
+    run(nb_excerpts, batch_sizes)
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import pandas as pd
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+def fingerprint(*parts):
+    '''sha256 of json-encodable parts, e.g. the fingerprint of a stage input and the stage settings'''
+    material = json.dumps(parts, sort_keys = True, default = str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def json_encode(value):
+    return json.dumps(value, default = lambda x: x.item())
+
+
+def encode_frame(df):
+    '''frame Parquet can store: object columns holding lists, dicts or numbers are json-encoded.
+    Returns the encoded frame and the names of the encoded columns.'''
+    encoded_columns = []
+    df = df.reset_index(drop = True)
+    for column in df.columns:
+        if df[column].dtype == object and not all(isinstance(x, str) or x is None for x in df[column]):
+            df[column] = [json_encode(x) for x in df[column]]
+            encoded_columns.append(column)
+    return df, encoded_columns
+
+
+def decode_frame(df, encoded_columns):
+    for column in encoded_columns:
+        df[column] = [json.loads(x) for x in df[column]]
+    return df
+
+
+def content_fingerprint(frames):
+    '''fingerprint of the content of {name: frame}, for stages that have no fingerprinted input'''
+    digest = hashlib.sha256()
+    for name in sorted(frames):
+        encoded, _ = encode_frame(frames[name])
+        digest.update(name.encode('utf-8'))
+        digest.update(json.dumps([str(x) for x in encoded.columns]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(encoded, index = False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class StageCheckpoints:
+    '''Output of every pipeline stage, stored as Parquet files in a local directory.
+
+    Every stage writes <stage>-<frame>.parquet files and then <stage>.json, which
+    records the fingerprint of the stage input and of the stage itself (its input and
+    settings). The json file is removed before and written after the Parquet files, so
+    a stage interrupted while saving has no checkpoint rather than a mixed one. A
+    checkpoint is valid for a run when its fingerprint matches the one the run
+    computes, so changing an upstream output or the settings of a stage invalidates
+    that stage and every stage after it.
+    '''
+
+    def __init__(self, directory = CHECKPOINT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, stage, name = None):
+        if name is None:
+            return os.path.join(self.directory, stage + '.json')
+        return os.path.join(self.directory, stage + '-' + name + '.parquet')
+
+    def metadata(self, stage):
+        if not os.path.exists(self.path(stage)):
+            return None
+        with open(self.path(stage)) as json_file:
+            return json.load(json_file)
+
+    def load(self, stage, expected_fingerprint = None, input_fingerprint = None):
+        '''(frames, fingerprint) of the stored checkpoint, or None if there is none, or it does not match
+        expected_fingerprint, or it was not computed from the input with input_fingerprint'''
+        metadata = self.metadata(stage)
+        if metadata is None:
+            return None
+        if expected_fingerprint is not None and metadata['fingerprint'] != expected_fingerprint:
+            return None
+        if input_fingerprint is not None and metadata['input_fingerprint'] != input_fingerprint:
+            logging.warning('Checkpoint of stage %s was computed from another input than the previous stage checkpoint', stage)
+            return None
+        try:
+            frames = {name: decode_frame(pd.read_parquet(self.path(stage, name)), encoded_columns)
+                      for name, encoded_columns in metadata['frames'].items()}
+        except (OSError, ValueError) as err:
+            logging.warning('Checkpoint of stage %s could not be read: %s', stage, err)
+            return None
+        logging.info('Loaded checkpoint of stage %s from %s', stage, time.strftime('%Y-%m-%d %H:%M', time.localtime(metadata['created_at'])))
+        return frames, metadata['fingerprint']
+
+    def save(self, stage, frames, stage_fingerprint, input_fingerprint = None):
+        if os.path.exists(self.path(stage)):
+            os.remove(self.path(stage))
+        frame_columns = {}
+        for name, df in frames.items():
+            encoded, encoded_columns = encode_frame(df)
+            encoded.to_parquet(self.path(stage, name) + '.tmp', index = False)
+            os.replace(self.path(stage, name) + '.tmp', self.path(stage, name))
+            frame_columns[name] = encoded_columns
+
+        with open(self.path(stage) + '.tmp', 'w') as json_file:
+            json.dump({'stage': stage, 'fingerprint': stage_fingerprint, 'input_fingerprint': input_fingerprint,
+                       'created_at': time.time(), 'frames': frame_columns}, json_file)
+        os.replace(self.path(stage) + '.tmp', self.path(stage))
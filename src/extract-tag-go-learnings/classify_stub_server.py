@@ -0,0 +1,86 @@
+import sys
+import json
+import time
+import random
+import zlib
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local stand-in for the dreftagging classify endpoint, to benchmark tag_data offline
+
+PER_COMPONENTS = [
+    "Logistics - Procurement",
+    "Coordination with Authorities",
+    "Staff and Volunteer Management",
+    "Information Management",
+    "Cash and Voucher Assistance",
+    "Activation of Regional and International Support",
+]
+
+# simulated cost of one request (network round trip + model call) and of each excerpt in it
+REQUEST_LATENCY = 0.05
+EXCERPT_LATENCY = 0.002
+
+
+def classify(excerpt):
+    '''deterministic fake tags: one PER component per excerpt, none for one excerpt in ten'''
+    digest = zlib.crc32(excerpt.encode('utf-8'))
+    if digest % 10 == 0:
+        return {'tags': []}
+    return {'tags': [PER_COMPONENTS[digest % len(PER_COMPONENTS)]]}
+
+
+def make_handler(request_latency, excerpt_latency, max_batch_size, error_rate):
+
+    class ClassifyHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                payload = json.loads(body)
+            except json.JSONDecodeError:
+                return self.reply(400, {'detail': 'invalid json'})
+
+            excerpts = [payload] if isinstance(payload, str) else payload
+            if len(excerpts) > max_batch_size:
+                return self.reply(413, {'detail': f'at most {max_batch_size} excerpts per request'})
+
+            # simulated overload, answered before doing any work
+            if random.random() < error_rate:
+                return self.reply(random.choice([429, 503]), {'detail': 'try again later'})
+
+            time.sleep(request_latency + excerpt_latency * len(excerpts))
+            self.reply(201, [classify(x) for x in excerpts])
+
+        def reply(self, status_code, content):
+            data = json.dumps(content).encode('utf-8')
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return ClassifyHandler
+
+
+def start_server(port=0, request_latency=REQUEST_LATENCY, excerpt_latency=EXCERPT_LATENCY, max_batch_size=1000, error_rate=0.0):
+    '''starts the stub in a background thread, returns the server and its classify url'''
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(request_latency, excerpt_latency, max_batch_size, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/classify"
+    logging.info('Classify stub server listening on %s', url)
+    return server, url
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+    server, url = start_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
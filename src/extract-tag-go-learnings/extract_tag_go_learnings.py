@@ -1,378 +1,931 @@
-import pandas as pd
-import numpy as np
-import requests
-import json
-import retrying
-from retrying import retry
-import time
-from nltk.tokenize import LineTokenizer
-import logging
-
-CLASSIFY_URL = "https://dreftagging.azurewebsites.net/classify"
-GO_API_URL = "https://goadmin.ifrc.org/api/v2/"
-OPS_LEARNING_URL = GO_API_URL + "ops-learning/"
-LIMIT_200 = "/?limit=200/"
-
-logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
-
-def fetch_data(dref_final_report, appeal, ops_learning, go_auth_token_path):
-    
-    with open(go_auth_token_path) as json_file:
-        go_authorization_token = json.load(json_file)
-
-    def fetchUrl(field):
-        return requests.get(field,headers = go_authorization_token).json()
-
-    def fetchField(field):
-        dict_field = []
-        temp_dict = requests.get(GO_API_URL+field+LIMIT_200, headers = go_authorization_token).json()
-        while temp_dict['next']:
-            dict_field.extend(temp_dict['results'])
-            temp_dict = fetchUrl(temp_dict['next'])
-        dict_field.extend(temp_dict['results'])
-        return pd.DataFrame.from_dict(dict_field)
-
-    #read dref final reports, to extract learnings in planned interventions
-    logging.info('Fetching DREF Final Reports from GO')
-    dref_final_report = fetchField(dref_final_report)
-
-    #read appeals to verify which drefs (appeals) are public and which drefs (appeals) are silent
-    logging.info('Fetching Appeals from GO')
-    appeals = fetchField(appeal)
-
-    #read ops learning to verify which drefs have already been processed
-    logging.info('Fetching Operational Learnings from GO')
-    ops_learning = fetchField(ops_learning)
-    ops_learning['appeal_code'] = [x['code'] for x in ops_learning['appeal']]
-    
-    return dref_final_report, appeals, ops_learning
-
-
-def filter_final_report(final_report, appeal, ops_learning, final_report_is_published = True, appeal_is_published = True, in_ops_learning = False):
-    
-    if final_report_is_published:
-        logging.info('Filtering only DREF Final Reports that have been closed')
-        mask = [x for x in final_report['is_published']]
-        final_report = final_report[mask]
-        
-    if appeal_is_published:
-        logging.info('Filtering only DREF Final Reports that are public')
-        mask = [x in list(appeal['code']) for x in final_report['appeal_code']]
-        final_report = final_report[mask]
-        
-        
-    if not in_ops_learning:
-        logging.info('Filtering only DREF Final Reports that have not been processed yet for operational learning')
-        list_new_reports = np.setdiff1d(final_report['appeal_code'].unique(),ops_learning['appeal_code'].unique())
-        
-        #only reports that are not processed yet
-        mask = [x in list_new_reports for x in final_report['appeal_code']]
-        final_report = final_report[mask]
-        
-    if final_report.empty:
-        logging.warning('There were not find any DREF Final Reports after the filtering process')
-        return None
-    
-    else:
-        filtered_final_report = final_report[['appeal_code','planned_interventions']]
-        logging.info('There were found %s reports after the filtering process', str(len(filtered_final_report)))
-        return filtered_final_report
-
-
-def split_rows(filtered_final_report):
-    
-    def split_planned_interventions(df):
-        logging.info('Splitting DREF Final Reports per planned intervention')
-        df = df.explode(column = 'planned_interventions', ignore_index = True)
-    
-        df['Sector'] = [x['title_display'] for x in df['planned_interventions']]
-        df['Lessons Learnt'] = [x['lessons_learnt'] for x in df['planned_interventions']]
-        df['Challenges'] = [x['challenges'] for x in df['planned_interventions']]
-    
-        mask_1 = [pd.notna(x) for x in df['Lessons Learnt']]
-        mask_2 = [pd.notna(x) for x in df['Challenges']]
-        mask = [x or y for x,y in zip(mask_1,mask_2)]
-        df = df[mask]
-        df.drop(columns = 'planned_interventions', inplace =True)
-        
-        df = df.melt(id_vars = ['appeal_code','Sector'],value_vars = ['Lessons Learnt','Challenges'],var_name='Finding', value_name='Excerpts')
-        df = df[pd.notna(df['Excerpts'])]
-        
-        return df
-
-    
-    def split_excerpts(df):
-        logging.info('Splitting unique learnings in each planned intervention')
-        df['Excerpts_ind'] = [LineTokenizer(blanklines='discard').tokenize(x) for x in df['Excerpts']]
-        df = df.explode(column = 'Excerpts_ind', ignore_index = True)
-        df.drop(columns = 'Excerpts', inplace =True)
-        
-        ## remove strings that have less than 5 characters
-        df['Excerpts_ind'] = [np.nan if pd.notna(x) and len(x) < 5 else x for x in df['Excerpts_ind']]
-        df = df[pd.notna(df['Excerpts_ind'])]
-        
-        #catching go format (bullet point)
-        df['Excerpts_ind'] = [x[2:] if x.startswith('•\t') else x for x in df['Excerpts_ind']]
-
-        #catching other formats
-        df['Excerpts_ind'] = [x[1:] if x.startswith(tuple(['-','•','▪',' '])) else x for x in df['Excerpts_ind']]
-
-        df['Excerpts'] = [x.strip() for x in df['Excerpts_ind']]
-        
-        df.drop(columns = 'Excerpts_ind', inplace =True)
-        
-        return df
-    
-    final_report_interventions = split_planned_interventions(filtered_final_report)
-    
-    if final_report_interventions.empty:
-        logging.warning('There were not found any learnings on the DREF Final Reports planned interventions')
-        return None
-    else:
-        final_report_learnings = split_excerpts(final_report_interventions)
-        return final_report_learnings
-
-
-def tag_data(df, tagging, tagging_api_endpoint):
-    logging.info('Tagging learnings with PER framework')
-    headers = {
-    'accept': 'application/json',
-    'Content-Type': 'application/json',
-    }
-    
-    url = tagging_api_endpoint
-    
-    df[tagging] = None
-    df.reset_index(inplace= True, drop = True)
-    
-    for i in range (0,len(df)):
-        data = "\""+df['Excerpts'].iloc[i]+"\""
-        data = data.encode('utf-8')
-        response = requests.post(url, headers=headers, data = data)
-        if (response.status_code==201) and len(response.json()[0]['tags']) > 0:
-            df.loc[i, tagging] = response.json()[0]['tags'][0]
-    
-    df['Institution'] = np.empty(len(df))
-    
-    for i in range(0,len(df)):
-        if (df['PER - Component'].iloc[i] == 'Activation of Regional and International Support'):
-            df.loc[i,'Institution'] = 'Secretariat'
-        else:
-            df.loc[i,'Institution']= 'National Society'
-        
-    tagged_data= df
-    return tagged_data
-
-
-def fetch_complementary_data(per_formcomponent, primary_sector):
-    logging.info('Fetching complementary data on PER components ids, sectors ids, finding ids, organisations ids')
-    def fetchUrl(field):
-        return requests.get(field).json()
-
-    def fetchField(field):
-        dict_field = []
-        temp_dict = requests.get(GO_API_URL+field+LIMIT_200).json()
-        while temp_dict['next']:
-            dict_field.extend(temp_dict['results'])
-            temp_dict = fetchUrl(temp_dict['next'])
-        dict_field.extend(temp_dict['results'])
-        return pd.DataFrame.from_dict(dict_field)
-
-    per_formcomponent = fetchField(per_formcomponent)
-    
-    go_sectors =  fetchUrl(GO_API_URL+primary_sector)
-    
-    dict_per = dict(zip(per_formcomponent['title'],per_formcomponent['id']))
-    
-    dict_sector = {item['label']: item['key'] for item in go_sectors}
-    
-    dict_finding = {
-        'Lessons Learnt': 1,  
-        'Challenges': 2
-    }
-    
-    dict_org = {
-        'Secretariat': 1,  
-        'National Society': 2
-    }  
-    
-    mapping_per = {
-    "Activation of Regional and International Support": "Activation of regional and international support",
-    "Affected Population Selection": "Affected population selection",
-    "Business Continuity": "Business continuity",
-    "Cash and Voucher Assistance": "Cash Based Intervention (CBI)",
-    "Communications in Emergencies": "Communication in emergencies",
-    "Coordination with Authorities": "Coordination with authorities",
-    "Coordination with External Agencies and NGOs": "Coordination with External Agencies and NGOs",
-    "Coordination with Local Community Level Responders": "Coordination with local community level responders",
-    "Coordination with Movement": "Coordination with Movement",
-    "DRM Laws, Advocacy and Dissemination": "DRM Laws, Advocacy and Dissemination",
-    "Early Action Mechanisms": "Early Action Mechanisms",
-    "Emergency Needs Assessment and Planning": "Emergency Needs Assessment",
-    "Emergency Operations Centre (EOC)": "Emergency Operations Centre (EOC)",
-    "Emergency Response Procedures (SOP)": "Emergency Response Procedures (SOPs)",
-    "Finance and Admin. Policy and Emergency Procedures": "Finance and Admin policy and emergency procedures",
-    "Hazard, Context and Risk Analysis, Monitoring and Early Warning": "Hazard, Context and Risk Analysis, Monitoring and Early Warning",
-    "Information and Communication Technology (ICT)": "Information and Communication Technology (ICT)",
-    "Information Management": "Information Management (IM)",
-    "Logistics - Logistics Management": "LOGISTICS MANAGEMENT",
-    "Logistics - Procurement": "PROCUREMENT",
-    "Logistics - Warehouse and Stock Management": "WAREHOUSE AND STOCK MANAGEMENT",
-    "Mapping of NS Capacities": "Mapping of NS capacities",
-    "NS Specific Areas of Intervention": "NS-specific areas of intervention",
-    "Operations Monitoring, Evaluation, Reporting and Learning": "Operations Monitoring, Evaluation, Reporting and Learning",
-    "Pre-Disaster Meetings and Agreements": "Pre-disaster meetings and agreements",
-    "Preparedness Plans and Budgets": "Preparedness plans and budgets",
-    "Quality and Accountability": "Quality and accountability",
-    "RC Auxiliary Role, Mandate and Law": "RC auxiliary role, Mandate and Law",
-    "Resources Mobilisation": "Resource Mobilisation",
-    "Response and Recovery Planning": "Response and recovery planning",
-    "Risk Management": "Risk management",
-    "Safety and Security Management": "Safety and security management",
-    "Staff and Volunteer Management": "Staff and volunteer management",
-    "Testing and Learning": "Testing and Learning",
-    "Cooperation with Private Sector": "Cooperation with private sector",
-    "Disaster Risk Management Strategy": "DRM Strategy",
-    "Logistics - Supply Chain Management": "SUPPLY CHAIN MANAGEMENT",
-    "Logistics - Transportation Management": "FLEET AND TRANSPORTATION MANAGEMENT",
-    "Scenario Planning": "Scenario planning",
-    "Civil Military Relations": "Civil Military Relations",
-    "Disaster Risk Management Policy": "DRM Policy",
-    "information and Communication Technology (ICT)": "Information and Communication Technology (ICT)",
-    "Coordination with local community level responders": "Coordination with local community level responders",
-    "Emergency Response Procedures (SOPs)": "Emergency Response Procedures (SOPs)",
-    "Logistics - Transport": "FLEET AND TRANSPORTATION MANAGEMENT",
-    "Unknown": None,
-    "Business continuity": "Business continuity",
-    "emergency Response Procedures (SOP)": "Emergency Response Procedures (SOPs)",
-    "National Society Specific Areas of intervention": "NS-specific areas of intervention"
-    }
-    
-    mapping_sector = {
-    "Strategies for implementation": None,  # No direct match found
-    "Disaster Risk Reduction and Climate Action": "DRR",
-    "Health": "Health (public)",
-    "Livelihoods and Basic Needs": "Livelihoods and basic needs",
-    "Migration and Displacement": "Migration",
-    "Protection, Gender and Inclusion": "PGI",
-    "Shelter and Settlements": "Shelter",
-    "Water Sanitation and Hygiene": "WASH",
-    "Secretariat Services": None,  # No direct match found # need to bring it out as IFRC learning
-    "National Society Strengthening": "NS Strengthening",
-    "Water, Sanitation And Hygiene": "WASH",
-    "Protection, Gender And Inclusion": "PGI",
-    "Shelter Housing And Settlements": "Shelter",  
-    "Livelihoods And Basic Needs": "Livelihoods and basic needs",
-    "Community Engagement And Accountability": "CEA",
-    "Multi-purpose Cash": "Livelihoods and basic needs",  # No direct match found
-    "Risk Reduction, Climate Adaptation And Recovery": "DRR", 
-    "Migration": "Migration",
-    "Education": "Education",
-    "Shelter and Basic Household Items":"Shelter",
-    "Multi Purpose Cash": "Livelihoods and basic needs", 
-    "Environmental Sustainability":None,
-    "Migration And Displacement":"Migration",
-    "Coordination And Partnerships":"NS Strengthening"}
-    
-    
-    return mapping_per, dict_per, mapping_sector, dict_sector, dict_org, dict_finding
-    
-def format_data(df, mapping_per, dict_per, mapping_sector, dict_sector,dict_org, dict_finding):
-    logging.info('Formatting data to upload to GO Operational Learning Table')
-    df.loc[:,'mapped_per'] = [mapping_per[x] if pd.notna(x) else None for x in df['PER - Component']]
-    df.loc[:,'id_per'] = [dict_per[x] if pd.notna(x) else None for x in df['mapped_per']]
-    df.loc[:,'mapped_sector'] = [mapping_sector[x] if pd.notna(x) else None for x in df['Sector']]
-    df.loc[:,'id_sector'] = [dict_sector[x] if pd.notna(x) else None for x in df['mapped_sector']]
-    df.loc[:,'id_institution'] =  [dict_org[x] for x in df['Institution']]
-    df.loc[:,'id_finding'] = [dict_finding[x] for x in df['Finding']]
-    
-    formatted_data = df[['appeal_code', 'Excerpts', 'id_per','id_sector','id_institution','id_finding']]
-    
-    return formatted_data
-
-
-def manage_duplicates(df):
-    logging.info('Managing duplicates')
-    df = df.groupby(['appeal_code','Excerpts','id_finding'], as_index = False).agg(list).reset_index()
-    df.drop(columns = ['index'], inplace = True)
-    
-    df['id_per'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_per']]
-    df['id_sector'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_sector']]
-    df['id_institution'] = [list(set([y for y in x if pd.notna(y)])) for x in df['id_institution']]
-    
-    deduplicated_data = df
-    
-    return deduplicated_data
-
-def post_to_api(df, api_post_endpoint, go_auth_token_path):
-    logging.info('Posting data to GO Operational Learning API')
-    with open(go_auth_token_path) as json_file:
-        go_authorization_token = json.load(json_file)
-    
-    url = api_post_endpoint
-    
-    myobj = {}
-    for i in range(0,len(df)):
-        myobj[i] = {"learning": df['Excerpts'].iloc[i],
-                    "learning_validated": df['Excerpts'].iloc[i],
-                    "appeal_code":df['appeal_code'].iloc[i],
-                    "type":int(df['id_finding'].iloc[i]),
-                    "type_validated":int(df['id_finding'].iloc[i]),
-                    "sector": df['id_sector'].iloc[i],
-                    "sector_validated": df['id_sector'].iloc[i],
-                    "per_component": df['id_per'].iloc[i],
-                    "per_component_validated": df['id_per'].iloc[i],
-                    "organization": df['id_institution'].iloc[i],
-                    "organization_validated": df['id_institution'].iloc[i],
-                    "is_validated": False
-                   }
-        
-    # Define a retry decorator
-    @retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5)
-    def post_request(x):
-        response = requests.post(url, json=myobj[x],headers = go_authorization_token)
-        response.raise_for_status()  # Raise HTTPError for bad responses
-        return response
-
-
-    for x in range(0, len(myobj)):
-        try:
-            response = post_request(x)
-            logging.info("Response status: %s", response.status_code)
-            time.sleep(1)
-        except requests.exceptions.HTTPError as errh:
-            print(f"HTTP Error: {errh}")
-            time.sleep(5)  # Wait before retrying
-        except requests.exceptions.RequestException as err:
-            print(f"Request Exception: {err}")
-            time.sleep(5)  # Wait before retrying
-
-def main(go_auth_token_path):
-    logging.info("Starting extracting tags for ops learnings")
-
-    # Step 1: Fetch Data
-    final_report, appeal, ops_learning = fetch_data('dref-final-report', 'appeal', 'ops-learning', go_auth_token_path)
-    filtered_data = filter_final_report(final_report, appeal, ops_learning, final_report_is_published = True, appeal_is_published = True, in_ops_learning = False)
-    
-    if filtered_data is not None:
-        # Step 2: Data Preprocessing
-        split_learnings = split_rows(filtered_data)
-
-        if split_learnings is not None:
-            # Step 3: Tagging
-            tagged_data = tag_data(split_learnings,'PER - Component' , CLASSIFY_URL)
-
-            # Step 4: Post Processing
-            mapping_per, dict_per, mapping_sector, dict_sector, dict_org, dict_finding = fetch_complementary_data('per-formcomponent', 'primarysector')
-            formatted_data = format_data(tagged_data,mapping_per, dict_per, mapping_sector, dict_sector,dict_org, dict_finding)
-            deduplicated_data = manage_duplicates(formatted_data)
-    
-            # Step 5: Post to API Endpoint
-            post_to_api(deduplicated_data, OPS_LEARNING_URL, go_auth_token_path)
-
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python extract_tag_go_learnings.py go_authorization_token_path")
-    else:
-        go_auth_token_path = sys.argv[1]
-        main(go_auth_token_path)
\ No newline at end of file
+import pandas as pd
+import numpy as np
+import requests
+import json
+import retrying
+from retrying import retry
+import time
+import os
+import re
+import random
+import hashlib
+import asyncio
+import argparse
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sys
+# modules shared by the jobs, e.g. go_api_cache, live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import go_api_cache
+import pipeline_metrics
+import ops_learning_mirror
+from tag_cache import TagCache
+from ops_learning_uploader import upload, UPLOAD_MAX_WORKERS, REJECTED_STATUS_CODES
+from posting_journal import PostingJournal
+from near_duplicates import collapse_near_duplicates
+from checkpoints import StageCheckpoints, CHECKPOINT_DIR, content_fingerprint, fingerprint as checkpoint_fingerprint
+
+CLASSIFY_URL = "https://dreftagging.azurewebsites.net/classify"
+CLASSIFY_HEADERS = {
+    'accept': 'application/json',
+    'Content-Type': 'application/json',
+    }
+CLASSIFY_BATCH_SIZE = 32
+CLASSIFY_CONCURRENCY = 8
+CLASSIFY_TIMEOUT = 30
+CLASSIFY_MAX_RETRIES = 5
+CLASSIFY_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+CLASSIFY_BACKOFF_SECONDS = 1
+CLASSIFY_BACKOFF_MAX_SECONDS = 30
+# part of the tag cache key: bump it when the hosted model changes
+CLASSIFIER_VERSION = "dreftagging-classify-v1"
+TAG_CACHE_PATH = "tag_cache.sqlite"
+TAG_CACHE_CHUNK_SIZE = 1000
+# when set, tag with this PER component model in-process (see local_classifier.py) instead of CLASSIFY_URL
+LOCAL_CLASSIFIER_MODEL_PATH = os.getenv("LOCAL_CLASSIFIER_MODEL_PATH")
+# set to a similarity between 0 and 1 to collapse near-duplicate excerpts before tagging
+NEAR_DUPLICATE_THRESHOLD = os.getenv("NEAR_DUPLICATE_THRESHOLD")
+# local ops-learning mirror for the already processed check, instead of downloading the whole table
+OPS_LEARNING_MIRROR_DIR = os.getenv(ops_learning_mirror.MIRROR_DIR_ENV)
+POSTING_JOURNAL_PATH = "posting_journal.sqlite"
+REFERENCE_INDEX_PATH = "reference_index.json"
+REFERENCE_INDEX_TTL = 7 * 24 * 3600
+# bump when the structure of the reference index changes
+REFERENCE_INDEX_VERSION = 1
+GO_API_URL = "https://goadmin.ifrc.org/api/v2/"
+OPS_LEARNING_URL = GO_API_URL + "ops-learning/"
+PAGE_LIMIT = 200
+LIMIT_200 = "/?limit=" + str(PAGE_LIMIT)
+FETCH_MAX_WORKERS = 8
+DREF_SNAPSHOT_PATH = "dref_final_report_snapshot.pkl"
+DREF_WATERMARK_PATH = "dref_final_report_watermark.json"
+SPLIT_CHUNK_SIZE = 10000
+MIN_EXCERPT_LENGTH = 5
+# the line boundaries of str.splitlines, as used by nltk's LineTokenizer
+LINE_BREAK_PATTERN = re.compile(r'\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+# go format (bullet point) first, then one leading character of the other formats
+BULLET_PATTERN = re.compile(r'^(?:•\t)?[-•▪ ]?')
+
+logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+
+def read_watermark(watermark_path):
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path) as json_file:
+        return json.load(json_file)['modified_at']
+
+
+def sync_final_report(new_final_report, snapshot_path, watermark_path):
+    '''merge the reports changed since the last run into the local snapshot and move the watermark forward'''
+    if os.path.exists(snapshot_path) and read_watermark(watermark_path) is not None:
+        snapshot = pd.read_pickle(snapshot_path)
+        # a report edited since the last run replaces its previous version
+        final_report = pd.concat([snapshot, new_final_report], ignore_index = True)
+        final_report = final_report.drop_duplicates(subset = 'id', keep = 'last').reset_index(drop = True)
+    else:
+        final_report = new_final_report.reset_index(drop = True)
+
+    if final_report.empty:
+        return final_report
+
+    # write the snapshot before the watermark, so a crash in between only re-fetches
+    final_report.to_pickle(snapshot_path + '.tmp')
+    os.replace(snapshot_path + '.tmp', snapshot_path)
+    with open(watermark_path + '.tmp', 'w') as json_file:
+        json.dump({'modified_at': final_report['modified_at'].max()}, json_file)
+    os.replace(watermark_path + '.tmp', watermark_path)
+
+    logging.info('%s DREF Final Reports changed since the last run, %s in the local snapshot', str(len(new_final_report)), str(len(final_report)))
+    return final_report
+
+
+def fetch_data(dref_final_report, appeal, ops_learning, go_auth_token_path, parallel = False, max_workers = FETCH_MAX_WORKERS, incremental = False, snapshot_path = DREF_SNAPSHOT_PATH, watermark_path = DREF_WATERMARK_PATH, cache = None, mirror_dir = None):
+    
+    with open(go_auth_token_path) as json_file:
+        go_authorization_token = json.load(json_file)
+
+    # incremental mode: only ask GO for the final reports modified since the stored watermark
+    final_report_params = ''
+    if incremental:
+        watermark = read_watermark(watermark_path) if os.path.exists(snapshot_path) else None
+        if watermark is not None:
+            logging.info('Fetching DREF Final Reports modified since %s', watermark)
+            final_report_params = '&modified_at__gte=' + quote(watermark)
+
+    def fetchUrl(field):
+        return go_api_cache.get(field, headers = go_authorization_token, cache = cache).json()
+
+    def fetchField(field, params = ''):
+        dict_field = []
+        temp_dict = fetchUrl(GO_API_URL+field+LIMIT_200+params)
+        while temp_dict['next']:
+            dict_field.extend(temp_dict['results'])
+            temp_dict = fetchUrl(temp_dict['next'])
+        dict_field.extend(temp_dict['results'])
+        return pd.DataFrame.from_dict(dict_field)
+
+    # parallel mode: read 'count' from the first page, then download the remaining
+    # offset pages concurrently over one pooled session and a bounded worker pool
+    @retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5)
+    def fetchPage(field, offset, params = ''):
+        response = go_api_cache.get(GO_API_URL+field+LIMIT_200+params+'&offset='+str(offset), headers = go_authorization_token, session = session, cache = cache)
+        response.raise_for_status()
+        return response.json()
+
+    def fetchFieldParallel(field, page_pool, params = ''):
+        first_page = fetchPage(field, 0, params)
+        offsets = range(PAGE_LIMIT, first_page['count'], PAGE_LIMIT)
+        logging.info('Fetching %s records of %s in %s pages', first_page['count'], field, len(offsets) + 1)
+        
+        dict_field = list(first_page['results'])
+        # map keeps the offset order, so rows come out as when following 'next' links
+        for page in page_pool.map(lambda offset: fetchPage(field, offset, params), offsets):
+            dict_field.extend(page['results'])
+        return pd.DataFrame.from_dict(dict_field)
+
+    if parallel:
+        logging.info('Fetching DREF Final Reports, Appeals and Operational Learnings from GO in parallel')
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers + 3)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        tables = [(dref_final_report, final_report_params), (appeal, '')]
+        if mirror_dir is None:
+            tables.append((ops_learning, ''))
+        with ThreadPoolExecutor(max_workers = max_workers) as page_pool, ThreadPoolExecutor(max_workers = 3) as table_pool:
+            futures = [table_pool.submit(fetchFieldParallel, field, page_pool, params) for field, params in tables]
+            fetched_tables = [future.result() for future in futures]
+        dref_final_report, appeals = fetched_tables[:2]
+        if mirror_dir is None:
+            ops_learning = fetched_tables[2]
+        session.close()
+
+    else:
+        #read dref final reports, to extract learnings in planned interventions
+        logging.info('Fetching DREF Final Reports from GO')
+        dref_final_report = fetchField(dref_final_report, final_report_params)
+
+        #read appeals to verify which drefs (appeals) are public and which drefs (appeals) are silent
+        logging.info('Fetching Appeals from GO')
+        appeals = fetchField(appeal)
+
+        #read ops learning to verify which drefs have already been processed
+        if mirror_dir is None:
+            logging.info('Fetching Operational Learnings from GO')
+            ops_learning = fetchField(ops_learning)
+
+    if mirror_dir is not None:
+        logging.info('Syncing the local Operational Learnings mirror with GO')
+        mirror = ops_learning_mirror.OpsLearningMirror(mirror_dir, headers = go_authorization_token)
+        # the processed check needs the current learnings, the sync only downloads the ones changed since the last run
+        mirror.sync(force = True)
+        ops_learning = mirror.appeal_codes()
+    else:
+        ops_learning['appeal_code'] = [x['code'] for x in ops_learning['appeal']]
+
+    if incremental:
+        dref_final_report = sync_final_report(dref_final_report, snapshot_path, watermark_path)
+    
+    return dref_final_report, appeals, ops_learning
+
+
+def filter_final_report(final_report, appeal, ops_learning, final_report_is_published = True, appeal_is_published = True, in_ops_learning = False, journaled_appeals = None):
+    
+    if final_report_is_published:
+        logging.info('Filtering only DREF Final Reports that have been closed')
+        mask = final_report['is_published'].astype(bool)
+        final_report = final_report[mask]
+        
+    if appeal_is_published:
+        logging.info('Filtering only DREF Final Reports that are public')
+        # isin hashes the appeal codes once, instead of scanning the list for every report
+        mask = final_report['appeal_code'].isin(appeal['code'])
+        final_report = final_report[mask]
+        
+        
+    if not in_ops_learning:
+        logging.info('Filtering only DREF Final Reports that have not been processed yet for operational learning')
+        
+        #only reports that are not processed yet
+        mask = ~final_report['appeal_code'].isin(ops_learning['appeal_code'])
+        final_report = final_report[mask]
+        
+    if journaled_appeals:
+        logging.info('Filtering out DREF Final Reports whose learnings are pending in the posting journal')
+        # pending learnings are resumed from the journal, not re-tagged
+        mask = ~final_report['appeal_code'].isin(journaled_appeals)
+        final_report = final_report[mask]
+        
+    if final_report.empty:
+        logging.warning('There were not find any DREF Final Reports after the filtering process')
+        return None
+    
+    else:
+        filtered_final_report = final_report[['appeal_code','planned_interventions']]
+        logging.info('There were found %s reports after the filtering process', str(len(filtered_final_report)))
+        return filtered_final_report
+
+
+def split_excerpt_text(text):
+    '''split one planned intervention text into unique learnings, cleaned as in split_rows'''
+    excerpts = []
+    for line in LINE_BREAK_PATTERN.split(text):
+        ## remove blank lines and strings that have less than 5 characters
+        if len(line) < MIN_EXCERPT_LENGTH or not line.rstrip():
+            continue
+        excerpts.append(BULLET_PATTERN.sub('', line, count = 1).strip())
+    return excerpts
+
+
+def segment_excerpts(excerpts):
+    '''split a Series of texts into one cleaned learning per line, repeating the index of the source row'''
+    lines = excerpts.str.split(LINE_BREAK_PATTERN).explode()
+    
+    ## remove blank lines and strings that have less than 5 characters, in one mask
+    mask = (lines.str.len() >= MIN_EXCERPT_LENGTH) & (lines.str.rstrip().str.len() > 0)
+    lines = lines[mask.fillna(False).astype(bool)]
+    
+    #catching go format (bullet point) and other formats
+    return lines.str.replace(BULLET_PATTERN, '', n = 1, regex = True).str.strip()
+
+
+
+def split_excerpts(df):
+    '''one row per learning of the Excerpts column, the other columns repeated from the source row'''
+    logging.info('Splitting unique learnings in each planned intervention')
+    excerpts = segment_excerpts(df['Excerpts'])
+    
+    df = df.drop(columns = 'Excerpts').loc[excerpts.index].reset_index(drop = True)
+    df['Excerpts'] = excerpts.to_numpy()
+    
+    return df
+
+
+def iter_split_rows(filtered_final_report, chunk_size = SPLIT_CHUNK_SIZE):
+    '''walk the final reports one at a time and yield flat learnings in DataFrames of at most chunk_size rows'''
+    columns = ['appeal_code','Sector','Finding','Excerpts']
+    records = []
+    for appeal_code, planned_interventions in zip(filtered_final_report['appeal_code'], filtered_final_report['planned_interventions']):
+        if not isinstance(planned_interventions, list):
+            continue
+        for intervention in planned_interventions:
+            for finding, field in [('Lessons Learnt', 'lessons_learnt'), ('Challenges', 'challenges')]:
+                if pd.isna(intervention[field]):
+                    continue
+                for excerpt in split_excerpt_text(intervention[field]):
+                    records.append((appeal_code, intervention['title_display'], finding, excerpt))
+                    if len(records) == chunk_size:
+                        yield pd.DataFrame.from_records(records, columns = columns)
+                        records = []
+    if records:
+        yield pd.DataFrame.from_records(records, columns = columns)
+
+
+def split_rows(filtered_final_report, streaming = False, chunk_size = SPLIT_CHUNK_SIZE):
+    
+    if streaming:
+        # no exploded/melted intermediate frames, and the per-learning records are only held
+        # for one chunk; the chunks and their concatenation are in memory together, so the
+        # peak is about twice the returned frame and grows with the number of learnings
+        logging.info('Splitting DREF Final Reports into unique learnings per planned intervention, in chunks of %s', str(chunk_size))
+        chunks = list(iter_split_rows(filtered_final_report, chunk_size))
+        if not chunks:
+            logging.warning('There were not found any learnings on the DREF Final Reports planned interventions')
+            return None
+        return pd.concat(chunks, ignore_index = True)
+    
+    def split_planned_interventions(df):
+        logging.info('Splitting DREF Final Reports per planned intervention')
+        df = df.explode(column = 'planned_interventions', ignore_index = True)
+    
+        df['Sector'] = [x['title_display'] for x in df['planned_interventions']]
+        df['Lessons Learnt'] = [x['lessons_learnt'] for x in df['planned_interventions']]
+        df['Challenges'] = [x['challenges'] for x in df['planned_interventions']]
+    
+        mask_1 = [pd.notna(x) for x in df['Lessons Learnt']]
+        mask_2 = [pd.notna(x) for x in df['Challenges']]
+        mask = [x or y for x,y in zip(mask_1,mask_2)]
+        df = df[mask]
+        df.drop(columns = 'planned_interventions', inplace =True)
+        
+        df = df.melt(id_vars = ['appeal_code','Sector'],value_vars = ['Lessons Learnt','Challenges'],var_name='Finding', value_name='Excerpts')
+        df = df[pd.notna(df['Excerpts'])]
+        
+        return df
+
+    
+    final_report_interventions = split_planned_interventions(filtered_final_report)
+    
+    if final_report_interventions.empty:
+        logging.warning('There were not found any learnings on the DREF Final Reports planned interventions')
+        return None
+    else:
+        final_report_learnings = split_excerpts(final_report_interventions)
+        return final_report_learnings
+
+
+def classify_request_data(excerpts):
+    if len(excerpts) == 1:
+        data = "\""+excerpts[0]+"\""
+    else:
+        # the classifier answers with one result per excerpt, in the same order
+        data = json.dumps(excerpts)
+    return data.encode('utf-8')
+
+
+def parse_classify_response(response, nb_excerpts):
+    if response is None or response.status_code != 201:
+        return None
+    results = response.json()
+    if len(results) != nb_excerpts:
+        return None
+    return [x['tags'] for x in results]
+
+
+def classify_batch(excerpts, tagging_api_endpoint, session = requests):
+    '''post excerpts to the classifier in one request, returns their lists of tags or None if the request failed'''
+    try:
+        response = session.post(tagging_api_endpoint, headers = CLASSIFY_HEADERS, data = classify_request_data(excerpts))
+    except requests.exceptions.RequestException as err:
+        logging.warning('Classifier request failed: %s', err)
+        return None
+    
+    return parse_classify_response(response, len(excerpts))
+
+
+def classify_excerpts(excerpts, tagging_api_endpoint, batch_size = 1):
+    '''classify excerpts in batches of batch_size, returns one list of tags (or None if it failed) per excerpt'''
+    session = requests.Session()
+    
+    def classify(batch):
+        tags = classify_batch(batch, tagging_api_endpoint, session)
+        if tags is not None:
+            return tags
+        if len(batch) == 1:
+            return [None]
+        # split a failed batch and retry both halves, down to single excerpts
+        middle = len(batch) // 2
+        return classify(batch[:middle]) + classify(batch[middle:])
+    
+    tags = []
+    for start in range(0, len(excerpts), batch_size):
+        tags.extend(classify(excerpts[start:start+batch_size]))
+    session.close()
+    return tags
+
+
+async def classify_excerpts_async(excerpts, tagging_api_endpoint, batch_size = 1, concurrency = CLASSIFY_CONCURRENCY, timeout = CLASSIFY_TIMEOUT, max_retries = CLASSIFY_MAX_RETRIES):
+    '''classify excerpts with at most `concurrency` requests in flight, retrying 429/5xx and timeouts with exponential backoff'''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {'done': 0, 'requests': 0, 'retries': 0, 'logged_at': time.monotonic()}
+    start = time.monotonic()
+    
+    async def post(batch):
+        for attempt in range(max_retries + 1):
+            async with semaphore:
+                progress['requests'] += 1
+                try:
+                    # requests is blocking, each call runs in the default thread pool
+                    response = await asyncio.to_thread(session.post, tagging_api_endpoint, headers = CLASSIFY_HEADERS, data = classify_request_data(batch), timeout = timeout)
+                except requests.exceptions.RequestException as err:
+                    logging.warning('Classifier request failed: %s', err)
+                    response = None
+            
+            if response is not None and response.status_code not in CLASSIFY_RETRY_STATUS_CODES:
+                return parse_classify_response(response, len(batch))
+            if attempt < max_retries:
+                progress['retries'] += 1
+                backoff = min(CLASSIFY_BACKOFF_SECONDS * 2 ** attempt, CLASSIFY_BACKOFF_MAX_SECONDS)
+                await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+        return None
+    
+    def log_progress(force = False):
+        now = time.monotonic()
+        if force or now - progress['logged_at'] >= 10:
+            progress['logged_at'] = now
+            logging.info('Tagged %s/%s learnings, %.1f learnings/s (%s requests, %s retries)', progress['done'], len(excerpts), progress['done'] / max(now - start, 1e-9), progress['requests'], progress['retries'])
+    
+    async def classify(batch):
+        tags = await post(batch)
+        if tags is None and len(batch) > 1:
+            # split a failed batch and retry both halves, down to single excerpts
+            middle = len(batch) // 2
+            halves = await asyncio.gather(classify(batch[:middle]), classify(batch[middle:]))
+            return halves[0] + halves[1]
+        if tags is None:
+            tags = [None]
+        progress['done'] += len(batch)
+        log_progress()
+        return tags
+    
+    batches = [excerpts[start:start+batch_size] for start in range(0, len(excerpts), batch_size)]
+    results = await asyncio.gather(*[classify(batch) for batch in batches])
+    log_progress(force = True)
+    session.close()
+    return [tags for batch_tags in results for tags in batch_tags]
+
+
+def classify_excerpts_cached(excerpts, classify, tag_cache, chunk_size = TAG_CACHE_CHUNK_SIZE):
+    '''classify only the distinct excerpts missing from tag_cache, storing results chunk by chunk so a crashed run keeps them'''
+    keys = [tag_cache.key(x) for x in excerpts]
+    found = tag_cache.get_many(keys)
+    
+    # one classification per distinct missing excerpt, however many rows repeat it
+    missing = {}
+    for key, excerpt in zip(keys, excerpts):
+        if key not in found and key not in missing:
+            missing[key] = excerpt
+    logging.info('%s learnings tagged from the cache, %s distinct learnings to classify', str(sum(key in found for key in keys)), str(len(missing)))
+    
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), chunk_size):
+        chunk_keys = missing_keys[start:start+chunk_size]
+        chunk_tags = classify([missing[key] for key in chunk_keys])
+        # failed classifications are not cached, they are retried on the next run
+        results = [(key, tags) for key, tags in zip(chunk_keys, chunk_tags) if tags is not None]
+        tag_cache.put_many(results)
+        found.update(results)
+    
+    tag_cache.log_stats()
+    return [found.get(key) for key in keys]
+
+
+def tag_data(df, tagging, tagging_api_endpoint, batch_size = 1, concurrency = None, tag_cache = None, classifier = None):
+    logging.info('Tagging learnings with PER framework')
+    
+    df.reset_index(inplace= True, drop = True)
+    
+    def classify(excerpts):
+        # a local classifier (e.g. local_classifier.LocalClassifier) replaces the HTTP service
+        if classifier is not None:
+            return classifier.classify(excerpts)
+        if concurrency:
+            return asyncio.run(classify_excerpts_async(excerpts, tagging_api_endpoint, batch_size, concurrency))
+        return classify_excerpts(excerpts, tagging_api_endpoint, batch_size)
+    
+    if tag_cache is not None:
+        tags = classify_excerpts_cached(list(df['Excerpts']), classify, tag_cache)
+    else:
+        tags = classify(list(df['Excerpts']))
+    df[tagging] = [x[0] if x else None for x in tags]
+    
+    df['Institution'] = np.where(df['PER - Component'] == 'Activation of Regional and International Support', 'Secretariat', 'National Society')
+        
+    tagged_data= df
+    return tagged_data
+
+
+MAPPING_PER = {
+    "Activation of Regional and International Support": "Activation of regional and international support",
+    "Affected Population Selection": "Affected population selection",
+    "Business Continuity": "Business continuity",
+    "Cash and Voucher Assistance": "Cash Based Intervention (CBI)",
+    "Communications in Emergencies": "Communication in emergencies",
+    "Coordination with Authorities": "Coordination with authorities",
+    "Coordination with External Agencies and NGOs": "Coordination with External Agencies and NGOs",
+    "Coordination with Local Community Level Responders": "Coordination with local community level responders",
+    "Coordination with Movement": "Coordination with Movement",
+    "DRM Laws, Advocacy and Dissemination": "DRM Laws, Advocacy and Dissemination",
+    "Early Action Mechanisms": "Early Action Mechanisms",
+    "Emergency Needs Assessment and Planning": "Emergency Needs Assessment",
+    "Emergency Operations Centre (EOC)": "Emergency Operations Centre (EOC)",
+    "Emergency Response Procedures (SOP)": "Emergency Response Procedures (SOPs)",
+    "Finance and Admin. Policy and Emergency Procedures": "Finance and Admin policy and emergency procedures",
+    "Hazard, Context and Risk Analysis, Monitoring and Early Warning": "Hazard, Context and Risk Analysis, Monitoring and Early Warning",
+    "Information and Communication Technology (ICT)": "Information and Communication Technology (ICT)",
+    "Information Management": "Information Management (IM)",
+    "Logistics - Logistics Management": "LOGISTICS MANAGEMENT",
+    "Logistics - Procurement": "PROCUREMENT",
+    "Logistics - Warehouse and Stock Management": "WAREHOUSE AND STOCK MANAGEMENT",
+    "Mapping of NS Capacities": "Mapping of NS capacities",
+    "NS Specific Areas of Intervention": "NS-specific areas of intervention",
+    "Operations Monitoring, Evaluation, Reporting and Learning": "Operations Monitoring, Evaluation, Reporting and Learning",
+    "Pre-Disaster Meetings and Agreements": "Pre-disaster meetings and agreements",
+    "Preparedness Plans and Budgets": "Preparedness plans and budgets",
+    "Quality and Accountability": "Quality and accountability",
+    "RC Auxiliary Role, Mandate and Law": "RC auxiliary role, Mandate and Law",
+    "Resources Mobilisation": "Resource Mobilisation",
+    "Response and Recovery Planning": "Response and recovery planning",
+    "Risk Management": "Risk management",
+    "Safety and Security Management": "Safety and security management",
+    "Staff and Volunteer Management": "Staff and volunteer management",
+    "Testing and Learning": "Testing and Learning",
+    "Cooperation with Private Sector": "Cooperation with private sector",
+    "Disaster Risk Management Strategy": "DRM Strategy",
+    "Logistics - Supply Chain Management": "SUPPLY CHAIN MANAGEMENT",
+    "Logistics - Transportation Management": "FLEET AND TRANSPORTATION MANAGEMENT",
+    "Scenario Planning": "Scenario planning",
+    "Civil Military Relations": "Civil Military Relations",
+    "Disaster Risk Management Policy": "DRM Policy",
+    "information and Communication Technology (ICT)": "Information and Communication Technology (ICT)",
+    "Coordination with local community level responders": "Coordination with local community level responders",
+    "Emergency Response Procedures (SOPs)": "Emergency Response Procedures (SOPs)",
+    "Logistics - Transport": "FLEET AND TRANSPORTATION MANAGEMENT",
+    "Unknown": None,
+    "Business continuity": "Business continuity",
+    "emergency Response Procedures (SOP)": "Emergency Response Procedures (SOPs)",
+    "National Society Specific Areas of intervention": "NS-specific areas of intervention"
+    }
+
+MAPPING_SECTOR = {
+    "Strategies for implementation": None,  # No direct match found
+    "Disaster Risk Reduction and Climate Action": "DRR",
+    "Health": "Health (public)",
+    "Livelihoods and Basic Needs": "Livelihoods and basic needs",
+    "Migration and Displacement": "Migration",
+    "Protection, Gender and Inclusion": "PGI",
+    "Shelter and Settlements": "Shelter",
+    "Water Sanitation and Hygiene": "WASH",
+    "Secretariat Services": None,  # No direct match found # need to bring it out as IFRC learning
+    "National Society Strengthening": "NS Strengthening",
+    "Water, Sanitation And Hygiene": "WASH",
+    "Protection, Gender And Inclusion": "PGI",
+    "Shelter Housing And Settlements": "Shelter",  
+    "Livelihoods And Basic Needs": "Livelihoods and basic needs",
+    "Community Engagement And Accountability": "CEA",
+    "Multi-purpose Cash": "Livelihoods and basic needs",  # No direct match found
+    "Risk Reduction, Climate Adaptation And Recovery": "DRR", 
+    "Migration": "Migration",
+    "Education": "Education",
+    "Shelter and Basic Household Items":"Shelter",
+    "Multi Purpose Cash": "Livelihoods and basic needs", 
+    "Environmental Sustainability":None,
+    "Migration And Displacement":"Migration",
+    "Coordination And Partnerships":"NS Strengthening"}
+
+
+def fetch_complementary_data(per_formcomponent, primary_sector, cache = None):
+    logging.info('Fetching complementary data on PER components ids, sectors ids, finding ids, organisations ids')
+    def fetchUrl(field):
+        return go_api_cache.get(field, cache = cache).json()
+
+    def fetchField(field):
+        dict_field = []
+        temp_dict = fetchUrl(GO_API_URL+field+LIMIT_200)
+        while temp_dict['next']:
+            dict_field.extend(temp_dict['results'])
+            temp_dict = fetchUrl(temp_dict['next'])
+        dict_field.extend(temp_dict['results'])
+        return pd.DataFrame.from_dict(dict_field)
+
+    per_formcomponent = fetchField(per_formcomponent)
+    
+    go_sectors =  fetchUrl(GO_API_URL+primary_sector)
+    
+    dict_per = dict(zip(per_formcomponent['title'],per_formcomponent['id']))
+    
+    dict_sector = {item['label']: item['key'] for item in go_sectors}
+    
+    dict_finding = {
+        'Lessons Learnt': 1,  
+        'Challenges': 2
+    }
+    
+    dict_org = {
+        'Secretariat': 1,  
+        'National Society': 2
+    }  
+    
+    mapping_per = MAPPING_PER
+    
+    mapping_sector = MAPPING_SECTOR
+    
+    return mapping_per, dict_per, mapping_sector, dict_sector, dict_org, dict_finding
+
+
+def normalize_label(label):
+    return ' '.join(label.split()).casefold()
+
+
+def build_reference_index(mapping_per, dict_per, mapping_sector, dict_sector, dict_org, dict_finding):
+    '''compose label -> GO title -> GO id once, keyed by case-normalized label'''
+    def compose(mapping, dict_ids, name):
+        ids = {normalize_label(title): id for title, id in dict_ids.items()}
+        index = {}
+        for label, title in mapping.items():
+            id = ids.get(normalize_label(title)) if title is not None else None
+            if title is not None and id is None:
+                logging.warning('%s "%s" is mapped to "%s", which GO does not know', name, label, title)
+            if index.get(normalize_label(label), id) != id:
+                logging.warning('%s "%s" is mapped to different ids depending on its case', name, label)
+            index[normalize_label(label)] = id
+        return index
+    
+    return {
+        'per': compose(mapping_per, dict_per, 'PER component'),
+        'sector': compose(mapping_sector, dict_sector, 'Sector'),
+        'institution': dict(dict_org),
+        'finding': dict(dict_finding),
+    }
+
+
+def mappings_fingerprint():
+    '''changes whenever MAPPING_PER or MAPPING_SECTOR are edited, to invalidate a stored index'''
+    material = json.dumps([REFERENCE_INDEX_VERSION, MAPPING_PER, MAPPING_SECTOR], sort_keys = True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def load_reference_index(per_formcomponent, primary_sector, index_path = REFERENCE_INDEX_PATH, ttl = REFERENCE_INDEX_TTL, cache = None):
+    '''precompiled reference index from disk while fresh, otherwise fetched from GO, composed and stored again'''
+    if os.path.exists(index_path):
+        with open(index_path) as json_file:
+            stored = json.load(json_file)
+        if stored.get('fingerprint') == mappings_fingerprint() and time.time() - stored['created_at'] < ttl:
+            logging.info('Using the reference data index stored on %s', time.strftime('%Y-%m-%d %H:%M', time.localtime(stored['created_at'])))
+            return stored['index']
+    
+    index = build_reference_index(*fetch_complementary_data(per_formcomponent, primary_sector, cache = cache))
+    with open(index_path + '.tmp', 'w') as json_file:
+        json.dump({'fingerprint': mappings_fingerprint(), 'created_at': time.time(), 'index': index}, json_file)
+    os.replace(index_path + '.tmp', index_path)
+    return index
+
+
+ID_COLUMNS = ['id_per', 'id_sector', 'id_institution', 'id_finding']
+DUPLICATE_KEY = ['appeal_code', 'Excerpts', 'id_finding']
+
+
+def map_labels(labels, lookup):
+    '''nullable integer ids for a column of labels, calling lookup once per distinct label instead of once per row'''
+    labels = labels.astype('category')
+    ids = [lookup(x) for x in labels.cat.categories]
+    # code -1 (missing label) picks the trailing None
+    ids = np.array(ids + [None], dtype = object)[labels.cat.codes.to_numpy()]
+    return pd.array(ids, dtype = 'Int64')
+
+
+def as_formatted(df):
+    '''formatted learnings with categorical text and integer-coded ids'''
+    formatted_data = pd.DataFrame({
+        'appeal_code': df['appeal_code'].astype('category'),
+        'Excerpts': df['Excerpts'].astype('category'),
+    })
+    for column in ID_COLUMNS:
+        formatted_data[column] = df[column]
+    return formatted_data
+
+
+def log_unmapped_labels(labels, index, name):
+    '''warns once per distinct label missing from the index, unlike the labels mapped to None on purpose (e.g. Unknown)'''
+    for label, count in labels.value_counts().items():
+        if normalize_label(label) not in index:
+            logging.warning('%s "%s" is not in the mapping, %s learnings are posted without it', name, label, str(count))
+
+
+def format_data_indexed(df, reference_index):
+    '''format_data with the ids resolved in one lookup each from a reference index'''
+    logging.info('Formatting data to upload to GO Operational Learning Table')
+    per, sector = reference_index['per'], reference_index['sector']
+    log_unmapped_labels(df['PER - Component'], per, 'PER component')
+    log_unmapped_labels(df['Sector'], sector, 'Sector')
+    df = df.assign(
+        id_per = map_labels(df['PER - Component'], lambda x: per.get(normalize_label(x))),
+        id_sector = map_labels(df['Sector'], lambda x: sector.get(normalize_label(x))),
+        id_institution = map_labels(df['Institution'], reference_index['institution'].__getitem__),
+        id_finding = map_labels(df['Finding'], reference_index['finding'].__getitem__),
+    )
+    
+    formatted_data = as_formatted(df)
+    
+    return formatted_data
+
+    
+def format_data(df, mapping_per, dict_per, mapping_sector, dict_sector,dict_org, dict_finding):
+    logging.info('Formatting data to upload to GO Operational Learning Table')
+    df = df.assign(
+        id_per = map_labels(df['PER - Component'], lambda x: dict_per[mapping_per[x]] if pd.notna(mapping_per[x]) else None),
+        id_sector = map_labels(df['Sector'], lambda x: dict_sector[mapping_sector[x]] if pd.notna(mapping_sector[x]) else None),
+        id_institution = map_labels(df['Institution'], dict_org.__getitem__),
+        id_finding = map_labels(df['Finding'], dict_finding.__getitem__),
+    )
+    
+    formatted_data = as_formatted(df)
+    
+    return formatted_data
+
+
+def collect_ids(groups, ids, nb_groups):
+    '''sorted distinct non-null ids of every group, as lists of python ints'''
+    present = ~ids.isna()
+    groups, ids = groups[present], ids[present].to_numpy(dtype = 'int64')
+    order = np.lexsort((ids, groups))
+    groups, ids = groups[order], ids[order]
+    distinct = np.ones(len(ids), dtype = bool)
+    distinct[1:] = (groups[1:] != groups[:-1]) | (ids[1:] != ids[:-1])
+    groups, ids = groups[distinct], ids[distinct].tolist()
+    bounds = np.searchsorted(groups, np.arange(nb_groups + 1)).tolist()
+    return [ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def manage_duplicates(df):
+    logging.info('Managing duplicates')
+    # one aggregation keyed on the (appeal_code, Excerpts, id_finding) group codes, instead of lists of free text
+    groups = df.groupby(DUPLICATE_KEY, sort = True, observed = True, dropna = False).ngroup().to_numpy()
+    group_ids, first_rows = np.unique(groups, return_index = True)
+    nb_groups = len(group_ids)
+    
+    deduplicated_data = df[DUPLICATE_KEY].iloc[first_rows].reset_index(drop = True)
+    for column in ['id_per', 'id_sector', 'id_institution']:
+        deduplicated_data[column] = collect_ids(groups, df[column].array, nb_groups)
+    
+    return deduplicated_data
+
+def failure_reason(response):
+    if response is None:
+        return 'no response'
+    return str(response.status_code) + ' ' + response.text[:500]
+
+
+def post_payloads(myobj, api_post_endpoint, go_auth_token_path, max_workers = UPLOAD_MAX_WORKERS, bulk_endpoint = None, journal = None):
+    with open(go_auth_token_path) as json_file:
+        go_authorization_token = json.load(json_file)
+    
+    on_posted = on_failed = None
+    if journal is not None:
+        # every learning is durable as pending before the first post, and marked as soon as GO accepts or gives up on it
+        journal.enqueue(myobj)
+        myobj = [x for x in myobj if journal.status(x) == 'pending']
+        on_posted = lambda i: journal.mark_posted(myobj[i])
+        on_failed = lambda i, response: journal.mark_failed(myobj[i], failure_reason(response), rejected = response is not None and response.status_code in REJECTED_STATUS_CODES)
+    
+    # bounded worker pool behind a token bucket that backs off on 429/Retry-After (AIMD)
+    results, stats = upload(myobj, api_post_endpoint, go_authorization_token, max_workers = max_workers, bulk_url = bulk_endpoint, on_posted = on_posted, on_failed = on_failed)
+    return stats
+
+
+def resume_posting(api_post_endpoint, go_auth_token_path, journal):
+    '''post the learnings a previous run left pending in the journal'''
+    failed = journal.failed()
+    if failed:
+        logging.warning('%s learnings of %s appeals failed for good and are not posted again, e.g. %s: %s (after %s attempts)',
+                        str(len(failed)), str(len({x[0] for x in failed})), failed[-1][0], failed[-1][2], failed[-1][1])
+    pending = journal.pending()
+    if not pending:
+        return None
+    logging.info('Resuming %s learnings left pending by a previous run', str(len(pending)))
+    return post_payloads(pending, api_post_endpoint, go_auth_token_path, journal = journal)
+
+
+def post_to_api(df, api_post_endpoint, go_auth_token_path, max_workers = UPLOAD_MAX_WORKERS, bulk_endpoint = None, journal = None):
+    logging.info('Posting data to GO Operational Learning API')
+    
+    myobj = []
+    for i in range(0,len(df)):
+        myobj.append({"learning": df['Excerpts'].iloc[i],
+                    "learning_validated": df['Excerpts'].iloc[i],
+                    "appeal_code":df['appeal_code'].iloc[i],
+                    "type":int(df['id_finding'].iloc[i]),
+                    "type_validated":int(df['id_finding'].iloc[i]),
+                    "sector": df['id_sector'].iloc[i],
+                    "sector_validated": df['id_sector'].iloc[i],
+                    "per_component": df['id_per'].iloc[i],
+                    "per_component_validated": df['id_per'].iloc[i],
+                    "organization": df['id_institution'].iloc[i],
+                    "organization_validated": df['id_institution'].iloc[i],
+                    "is_validated": False
+                   })
+    
+    return post_payloads(myobj, api_post_endpoint, go_auth_token_path, max_workers, bulk_endpoint, journal)
+
+# post has no checkpoint, resuming from it loads every stage and only posts again
+PIPELINE_STAGES = ['fetch', 'filter', 'split', 'tag', 'format', 'dedup', 'post']
+
+
+def run_stage(checkpoints, stage, input_fingerprint, settings, compute, resume_from = None):
+    '''frames and fingerprint of a pipeline stage, or (None, None) when the stage found nothing.
+
+    Stages before resume_from are loaded from their latest checkpoint computed from the
+    previous stage checkpoint. Other stages reuse their checkpoint only when their input
+    and settings did not change; otherwise they are computed and checkpointed. The first
+    stage has no input fingerprint and is fingerprinted by its content.
+    '''
+    stage_fingerprint = checkpoint_fingerprint(input_fingerprint, settings) if input_fingerprint is not None else None
+    if resume_from is not None and PIPELINE_STAGES.index(stage) < PIPELINE_STAGES.index(resume_from):
+        loaded = checkpoints.load(stage, input_fingerprint = input_fingerprint)
+        if loaded is None:
+            logging.warning('No valid checkpoint of stage %s to resume from, running it', stage)
+    elif stage_fingerprint is not None:
+        loaded = checkpoints.load(stage, expected_fingerprint = stage_fingerprint)
+    else:
+        loaded = None
+    if loaded is not None:
+        return loaded
+    
+    frames = compute()
+    if frames is None:
+        return None, None
+    if stage_fingerprint is None:
+        stage_fingerprint = checkpoint_fingerprint(content_fingerprint(frames), settings)
+    checkpoints.save(stage, frames, stage_fingerprint, input_fingerprint)
+    return frames, stage_fingerprint
+
+
+def main(go_auth_token_path, resume_from = None):
+    logging.info("Starting extracting tags for ops learnings")
+    metrics = pipeline_metrics.from_env('extract_tag_go_learnings')
+    with metrics.run():
+        run_pipeline(go_auth_token_path, resume_from, metrics)
+
+
+def run_pipeline(go_auth_token_path, resume_from, metrics):
+    cache = go_api_cache.from_env()
+    journal = PostingJournal(POSTING_JOURNAL_PATH)
+    checkpoints = StageCheckpoints(CHECKPOINT_DIR)
+    if LOCAL_CLASSIFIER_MODEL_PATH:
+        from local_classifier import LocalClassifier
+        # loaded before fetching: its labels become PER - Component tags, a model with other labels is refused
+        classifier = LocalClassifier(LOCAL_CLASSIFIER_MODEL_PATH, expected_labels = MAPPING_PER)
+        classifier_version = classifier.version
+    else:
+        classifier = None
+        classifier_version = CLASSIFIER_VERSION
+
+    # Step 0: Finish posting what a previous run left pending
+    with metrics.stage('resume_posting') as stage:
+        stats = resume_posting(OPS_LEARNING_URL, go_auth_token_path, journal)
+        stage.rows_out = stats['posted'] if stats else 0
+
+    # Step 1: Fetch Data
+    def fetch_reports():
+        final_report, appeal, ops_learning = fetch_data('dref-final-report', 'appeal', 'ops-learning', go_auth_token_path, parallel = True, incremental = True, cache = cache, mirror_dir = OPS_LEARNING_MIRROR_DIR)
+        # only the columns the next stages use are checkpointed
+        return {'final_report': final_report[['appeal_code', 'is_published', 'planned_interventions']],
+                'appeal': appeal[['code']], 'ops_learning': ops_learning[['appeal_code']]}
+    
+    with metrics.stage('fetch') as stage:
+        fetched, fetch_fingerprint = run_stage(checkpoints, 'fetch', None, None, fetch_reports, resume_from)
+        stage.rows_out = len(fetched['final_report'])
+    
+    # posted appeals GO no longer has (e.g. deleted to be generated again) are extracted and posted again
+    forgotten = journal.forget_posted(fetched['ops_learning']['appeal_code'], checkpoints.metadata('fetch')['created_at'])
+    if forgotten:
+        logging.info('%s posted appeals are no longer in GO ops-learning, extracting them again', str(len(forgotten)))
+    journaled_appeals = journal.appeal_codes()
+    def filter_reports():
+        filtered_data = filter_final_report(fetched['final_report'], fetched['appeal'], fetched['ops_learning'], final_report_is_published = True, appeal_is_published = True, in_ops_learning = False, journaled_appeals = journaled_appeals)
+        return {'data': filtered_data} if filtered_data is not None else None
+    
+    with metrics.stage('filter', rows_in = len(fetched['final_report'])) as stage:
+        filtered, filter_fingerprint = run_stage(checkpoints, 'filter', fetch_fingerprint, sorted(journaled_appeals), filter_reports, resume_from)
+        stage.rows_out = len(filtered['data']) if filtered is not None else 0
+    
+    if filtered is not None:
+        # Step 2: Data Preprocessing
+        def split_reports():
+            split_learnings = split_rows(filtered['data'], streaming = True)
+            if split_learnings is not None and NEAR_DUPLICATE_THRESHOLD:
+                split_learnings = collapse_near_duplicates(split_learnings, threshold = float(NEAR_DUPLICATE_THRESHOLD))
+            return {'data': split_learnings} if split_learnings is not None else None
+        
+        split_settings = [MIN_EXCERPT_LENGTH, LINE_BREAK_PATTERN.pattern, BULLET_PATTERN.pattern, NEAR_DUPLICATE_THRESHOLD]
+        with metrics.stage('split', rows_in = len(filtered['data'])) as stage:
+            split, split_fingerprint = run_stage(checkpoints, 'split', filter_fingerprint, split_settings, split_reports, resume_from)
+            stage.rows_out = len(split['data']) if split is not None else 0
+
+        if split is not None:
+            # Step 3: Tagging
+            def tag_learnings():
+                tag_cache = TagCache(TAG_CACHE_PATH, classifier_version)
+                tagged_data = tag_data(split['data'],'PER - Component' , CLASSIFY_URL, concurrency = CLASSIFY_CONCURRENCY, tag_cache = tag_cache, classifier = classifier)
+                tag_cache.close()
+                return {'data': tagged_data}
+            
+            with metrics.stage('tag', rows_in = len(split['data'])) as stage:
+                tagged, tag_fingerprint = run_stage(checkpoints, 'tag', split_fingerprint, classifier_version, tag_learnings, resume_from)
+                stage.rows_out = len(tagged['data'])
+
+            # Step 4: Post Processing
+            # a mapping fix changes the reference index, so only format and dedup are redone
+            with metrics.stage('format', rows_in = len(tagged['data'])) as stage:
+                reference_index = load_reference_index('per-formcomponent', 'primarysector', cache = cache)
+                formatted, format_fingerprint = run_stage(checkpoints, 'format', tag_fingerprint, reference_index,
+                                                          lambda: {'data': format_data_indexed(tagged['data'], reference_index)}, resume_from)
+                stage.rows_out = len(formatted['data'])
+            with metrics.stage('dedup', rows_in = len(formatted['data'])) as stage:
+                deduplicated, _ = run_stage(checkpoints, 'dedup', format_fingerprint, None,
+                                            lambda: {'data': manage_duplicates(formatted['data'])}, resume_from)
+                stage.rows_out = len(deduplicated['data'])
+    
+            # Step 5: Post to API Endpoint
+            with metrics.stage('post', rows_in = len(deduplicated['data'])) as stage:
+                stats = post_to_api(deduplicated['data'], OPS_LEARNING_URL, go_auth_token_path, journal = journal)
+                stage.rows_out = stats['posted']
+
+    journal.close()
+    if cache is not None:
+        cache.log_stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Extract, tag and post operational learnings from the DREF Final Reports')
+    parser.add_argument('go_authorization_token_path')
+    parser.add_argument('--resume-from', choices = PIPELINE_STAGES,
+                        help = 'load the checkpoints of the stages before this one instead of running them again; '
+                             'post retries a failed post without fetching, tagging or formatting again')
+    args = parser.parse_args()
+    main(args.go_authorization_token_path, args.resume_from)
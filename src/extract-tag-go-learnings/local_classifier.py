@@ -0,0 +1,101 @@
+import os
+import sys
+import logging
+
+LOCAL_BATCH_SIZE = 32
+# below this score of the top label no tag is returned, as the service answers with an empty tag list
+LOCAL_MIN_SCORE = 0.5
+# as in the tokenizer settings of the classifier notebook
+MAX_LENGTH = 256
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+
+def export_onnx(model_path, output_path, quantize = True):
+    '''exports the transformers model to ONNX, with dynamic int8 quantization of the weights if requested'''
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    model = ORTModelForSequenceClassification.from_pretrained(model_path, export = True)
+    model.save_pretrained(output_path)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_path)
+
+    if quantize:
+        quantizer = ORTQuantizer.from_pretrained(output_path)
+        quantization_config = AutoQuantizationConfig.avx2(is_static = False, per_channel = False)
+        quantizer.quantize(save_dir = output_path, quantization_config = quantization_config)
+    logging.info('Model exported to ONNX in %s', output_path)
+    return output_path
+
+
+class LocalClassifier:
+    '''In-process CPU replacement for the dreftagging classify endpoint.
+
+    classify() takes a list of excerpts and returns one list of tags per excerpt,
+    like the HTTP service: the top label of the model, or no tag when its score is
+    below min_score. Excerpts are sorted by length and padded per batch, so short
+    excerpts are not padded to the longest one of the whole run.
+
+    model_path has to be a PER component classifier: with expected_labels, a model
+    with labels outside of them (e.g. the finding type classifier model2-20230818 of
+    the notebooks, labelled Other / Challenges / Lessons Learnt) is refused at load.
+    '''
+
+    def __init__(self, model_path, batch_size = LOCAL_BATCH_SIZE, onnx = False, quantized = False, min_score = LOCAL_MIN_SCORE, expected_labels = None):
+        import torch
+        from transformers import AutoTokenizer
+
+        self.torch = torch
+        self.batch_size = batch_size
+        self.min_score = min_score
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        if onnx:
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            file_name = QUANTIZED_FILE_NAME if quantized else "model.onnx"
+            self.model = ORTModelForSequenceClassification.from_pretrained(model_path, file_name = file_name)
+        else:
+            from transformers import AutoModelForSequenceClassification
+            self.model = AutoModelForSequenceClassification.from_pretrained(model_path).eval()
+            if quantized:
+                self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype = torch.qint8)
+
+        self.labels = self.model.config.id2label
+        if expected_labels is not None:
+            unknown_labels = sorted(set(self.labels.values()) - set(expected_labels))
+            if unknown_labels:
+                raise ValueError(f"Model {model_path} has labels that are not PER components: {unknown_labels}")
+        # part of the tag cache key, so tags from different models never mix
+        variant = ('onnx-' if onnx else 'torch-') + ('int8' if quantized else 'fp32')
+        self.version = 'local:' + os.path.basename(os.path.normpath(model_path)) + ':' + variant
+
+    def classify_batch(self, excerpts):
+        inputs = self.tokenizer(excerpts, padding = 'longest', truncation = True, max_length = MAX_LENGTH, return_tensors = 'pt')
+        with self.torch.no_grad():
+            logits = self.model(**inputs).logits
+        scores, label_ids = self.torch.softmax(logits, dim = -1).max(dim = -1)
+
+        tags = []
+        for score, label_id in zip(scores.tolist(), label_ids.tolist()):
+            if self.min_score is not None and score < self.min_score:
+                tags.append([])
+            else:
+                tags.append([self.labels[label_id]])
+        return tags
+
+    def classify(self, excerpts):
+        order = sorted(range(len(excerpts)), key = lambda i: len(excerpts[i]))
+        tags = [None] * len(excerpts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start+self.batch_size]
+            for i, batch_tags in zip(batch, self.classify_batch([excerpts[i] for i in batch])):
+                tags[i] = batch_tags
+        return tags
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+    if len(sys.argv) != 3:
+        print("Usage: python local_classifier.py model_path onnx_output_path")
+    else:
+        export_onnx(sys.argv[1], sys.argv[2])
@@ -0,0 +1,124 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+# excerpts are only compared with excerpts of the same appeal and finding, like manage_duplicates
+BLOCK_COLUMNS = ['appeal_code', 'Finding']
+# bounds the (permutations x shingles) matrix hashed at once to about 100 MB
+SHINGLES_PER_CHUNK = 100000
+# base of the polynomial rolling hash of the shingle characters
+SHINGLE_HASH_BASE = np.uint64(1000003)
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(excerpt):
+    '''casefolded excerpt without punctuation and with collapsed whitespace'''
+    return WHITESPACE_PATTERN.sub(' ', PUNCTUATION_PATTERN.sub(' ', excerpt.casefold())).strip()
+
+
+def shingle_hashes(excerpts, shingle_size = SHINGLE_SIZE):
+    '''64-bit polynomial hashes of the character shingles of the normalized excerpts, concatenated, and where each excerpt starts'''
+    texts = [normalize_text(x).ljust(shingle_size) for x in excerpts]
+    characters = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype = np.uint32).astype(np.uint64)
+    # rolling hash of every window of the joined texts, wrapping around modulo 2**64
+    hashes = np.zeros(len(characters) - shingle_size + 1, dtype = np.uint64)
+    for i in range(shingle_size):
+        hashes = hashes * SHINGLE_HASH_BASE + characters[i:len(hashes)+i]
+
+    # only keep the windows inside a single text
+    lengths = np.array([len(x) for x in texts])
+    counts = lengths - shingle_size + 1
+    offsets = np.cumsum(counts) - counts
+    positions = np.repeat(np.cumsum(lengths) - lengths - offsets, counts) + np.arange(counts.sum())
+    return hashes[positions], offsets
+
+
+def minhash_signatures(excerpts, num_perm = NUM_PERM, shingle_size = SHINGLE_SIZE, seed = 1):
+    '''(len(excerpts), num_perm) MinHash signatures, from num_perm multiply-shift hash functions over the shingles'''
+    rng = np.random.default_rng(seed)
+    # (a * x + b) mod 2**64 >> 32 with odd a is universal, and needs no modulo
+    a = rng.integers(0, np.iinfo(np.uint64).max, size = (num_perm, 1), dtype = np.uint64, endpoint = True) | np.uint64(1)
+    b = rng.integers(0, np.iinfo(np.uint64).max, size = (num_perm, 1), dtype = np.uint64, endpoint = True)
+
+    signatures = np.empty((len(excerpts), num_perm), dtype = np.uint32)
+    # excerpts are hashed in chunks of about SHINGLES_PER_CHUNK characters
+    chunk_ends = np.cumsum([len(x) for x in excerpts]) // SHINGLES_PER_CHUNK
+    bounds = np.flatnonzero(np.diff(chunk_ends)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(excerpts)]):
+        hashes, offsets = shingle_hashes(excerpts[start:end], shingle_size)
+        permuted = ((a * hashes + b) >> np.uint64(32)).astype(np.uint32)
+        signatures[start:end] = np.minimum.reduceat(permuted, offsets, axis = 1).T
+    return signatures
+
+
+def lsh_parameters(threshold, num_perm = NUM_PERM):
+    '''(bands, rows) splitting num_perm so that the LSH S-curve turns at about threshold'''
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(candidates, key = lambda x: abs((1 / x[0]) ** (1 / x[1]) - threshold))
+
+
+def connected_components(nb_items, left, right):
+    '''smallest member of the component of every item, for the edges left[i] - right[i]'''
+    labels = np.arange(nb_items)
+    while True:
+        smallest = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smallest)
+        np.minimum.at(updated, right, smallest)
+        # pointer jumping, every label ends on the root of its component
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def near_duplicate_clusters(excerpts, blocks, threshold = NEAR_DUPLICATE_THRESHOLD, num_perm = NUM_PERM):
+    '''position of the cluster representative (its first excerpt) for every excerpt.
+
+    Excerpts sharing a band of their MinHash signature within a block are candidates;
+    a candidate is merged with the first excerpt of its bucket when their signatures
+    estimate a Jaccard similarity of at least threshold. Every band is one sort, so the
+    cost grows with n log n instead of the n^2 of comparing all pairs.
+    '''
+    signatures = minhash_signatures(excerpts, num_perm)
+    nb_bands, nb_rows = lsh_parameters(threshold, num_perm)
+    left, right = [], []
+    for band in range(nb_bands):
+        # rows of the band folded into one 64-bit key; a colliding key only adds a candidate, checked below
+        band_keys = np.zeros(len(signatures), dtype = np.uint64)
+        for row in signatures[:, band*nb_rows:(band+1)*nb_rows].T:
+            band_keys = band_keys * np.uint64(1000003) ^ row.astype(np.uint64)
+        buckets = pd.DataFrame({'block': blocks, 'band': band_keys})
+        bucket_ids = buckets.groupby(['block', 'band'], sort = False).ngroup().to_numpy()
+        _, first_positions = np.unique(bucket_ids, return_index = True)
+        heads = first_positions[bucket_ids]
+        candidates = np.flatnonzero(heads != np.arange(len(heads)))
+        left.append(heads[candidates])
+        right.append(candidates)
+
+    left, right = np.concatenate(left), np.concatenate(right)
+    pairs = np.unique(np.stack([left, right], axis = 1), axis = 0) if len(left) else np.empty((0, 2), dtype = np.int64)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis = 1)
+    pairs = pairs[similarity >= threshold]
+    return connected_components(len(excerpts), pairs[:, 0], pairs[:, 1])
+
+
+def collapse_near_duplicates(df, threshold = NEAR_DUPLICATE_THRESHOLD, num_perm = NUM_PERM):
+    '''rewrites every excerpt to the first excerpt of its near-duplicate cluster, so manage_duplicates merges their tags'''
+    if df.empty:
+        return df
+    logging.info('Collapsing near-duplicate excerpts with a similarity threshold of %s', str(threshold))
+    blocks = df.groupby(BLOCK_COLUMNS, sort = False).ngroup().to_numpy()
+    representatives = near_duplicate_clusters(list(df['Excerpts']), blocks, threshold, num_perm)
+
+    excerpts = df['Excerpts'].to_numpy()
+    collapsed = df.copy()
+    collapsed['Excerpts'] = excerpts[representatives]
+    nb_rewritten = int((representatives != np.arange(len(df))).sum())
+    logging.info('%s excerpts out of %s were rewritten to a near-duplicate', str(nb_rewritten), str(len(df)))
+    return collapsed
@@ -0,0 +1,164 @@
+import time
+import random
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_MAX_WORKERS = 4
+# requests per second at start, and the bounds the adaptive rate moves within
+UPLOAD_RATE = 2.0
+UPLOAD_MIN_RATE = 0.2
+UPLOAD_MAX_RATE = 20.0
+UPLOAD_MAX_RETRIES = 5
+BULK_SIZE = 50
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# GO rejects the payload itself, posting it again gives the same answer
+REJECTED_STATUS_CODES = (400, 422)
+
+
+class AdaptiveTokenBucket:
+    '''Token bucket rate limiter with AIMD rate control.
+
+    Every success adds additive_increase / rate to the rate (about +additive_increase
+    per second of traffic); a throttled answer halves it and, with Retry-After,
+    holds every worker until the server allows new requests.
+    '''
+
+    def __init__(self, rate = UPLOAD_RATE, min_rate = UPLOAD_MIN_RATE, max_rate = UPLOAD_MAX_RATE, additive_increase = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.additive_increase = additive_increase
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    # at most one second of burst
+                    self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated_at = self.paused_until
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.additive_increase / self.rate)
+
+    def on_throttle(self, retry_after = None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+def parse_retry_after(response):
+    '''Retry-After in seconds, only the delay-seconds form is used'''
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def upload(payloads, url, headers, max_workers = UPLOAD_MAX_WORKERS, bucket = None, max_retries = UPLOAD_MAX_RETRIES, bulk_url = None, bulk_size = BULK_SIZE, on_posted = None, on_failed = None):
+    '''POSTs payloads over a bounded worker pool behind an adaptive rate limiter.
+
+    With bulk_url, payloads are sent as lists of bulk_size; if the bulk endpoint does
+    not exist (404/405) the upload falls back to one request per payload. on_posted(i)
+    is called for every payload the API accepted, on_failed(i, response) for every
+    payload it did not, with the last response or None. Returns one boolean per payload and
+    the upload counters.
+    '''
+    bucket = bucket or AdaptiveTokenBucket()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    stats = {'posted': 0, 'failed': 0, 'requests': 0, 'retries': 0, 'throttled': 0}
+    stats_lock = threading.Lock()
+    bulk = {'supported': bulk_url is not None}
+
+    def count(stat, value = 1):
+        with stats_lock:
+            stats[stat] += value
+
+    def post(target_url, body):
+        '''posts with retries, returns the final response or None if the request never got an answer'''
+        response = None
+        for attempt in range(max_retries + 1):
+            bucket.acquire()
+            count('requests')
+            try:
+                response = session.post(target_url, json = body, headers = headers, timeout = 60)
+            except requests.exceptions.RequestException as err:
+                logging.warning('Request exception: %s', err)
+                response = None
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                if response.ok:
+                    bucket.on_success()
+                return response
+            if attempt == max_retries:
+                break
+
+            count('retries')
+            if response is not None and response.status_code == 429:
+                count('throttled')
+                bucket.on_throttle(parse_retry_after(response))
+            else:
+                time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+        return response
+
+    def upload_one(index):
+        response = post(url, payloads[index])
+        if response is not None and response.ok:
+            count('posted')
+            if on_posted is not None:
+                on_posted(index)
+            return True
+        count('failed')
+        logging.error('Learning %s was not posted: %s', index, response.status_code if response is not None else 'no response')
+        if on_failed is not None:
+            on_failed(index, response)
+        return False
+
+    def upload_chunk(indexes):
+        if bulk['supported']:
+            response = post(bulk_url, [payloads[i] for i in indexes])
+            if response is not None and response.ok:
+                count('posted', len(indexes))
+                if on_posted is not None:
+                    for i in indexes:
+                        on_posted(i)
+                return [True] * len(indexes)
+            if response is not None and response.status_code in (404, 405):
+                logging.warning('Bulk endpoint %s not available, posting learnings one by one', bulk_url)
+                bulk['supported'] = False
+        return [upload_one(i) for i in indexes]
+
+    start = time.monotonic()
+    chunk_size = bulk_size if bulk_url is not None else 1
+    chunks = [list(range(i, min(i + chunk_size, len(payloads)))) for i in range(0, len(payloads), chunk_size)]
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        results = [ok for chunk_results in pool.map(upload_chunk, chunks) for ok in chunk_results]
+    session.close()
+
+    stats['elapsed_seconds'] = round(time.monotonic() - start, 2)
+    stats['learnings_per_second'] = round(stats['posted'] / stats['elapsed_seconds'], 2) if stats['elapsed_seconds'] else None
+    stats['final_rate'] = round(bucket.rate, 2)
+    logging.info('Upload finished: %s posted, %s failed in %s s (%s learnings/s); %s requests, %s retries, %s throttled, final rate %s req/s',
+                 stats['posted'], stats['failed'], stats['elapsed_seconds'], stats['learnings_per_second'],
+                 stats['requests'], stats['retries'], stats['throttled'], stats['final_rate'])
+    return results, stats
@@ -0,0 +1,144 @@
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# posts of one learning, over successive runs, before it is given up as failed
+POSTING_MAX_ATTEMPTS = 5
+
+
+class PostingJournal:
+    '''Durable record of the learnings posted to the GO ops-learning table, in SQLite.
+
+    Every learning is written as pending, with its full payload, before posting starts,
+    and marked as posted as soon as GO accepts it. Learnings are keyed by
+    (appeal_code, excerpt hash, finding), so enqueueing the same learning twice is a
+    no-op. A run that stops halfway leaves its remaining learnings pending; the next
+    run posts them from the journal, without re-tagging their appeals.
+
+    Every failed post is counted with its error. A learning GO rejects (rejected) or
+    that failed max_attempts times is marked failed and is not posted again. Its
+    appeal is extracted again by the next runs: when that gives another payload (e.g.
+    after a mapping fix) the learning is pending again with it, an identical payload
+    stays failed. drop_failed() removes failed learnings from the journal.
+
+    Only appeals with pending learnings are kept out of extraction, posted appeals are
+    left to the check against GO's ops-learning table. When the learnings of a posted
+    appeal are no longer in GO (e.g. deleted to be generated again), forget_posted()
+    clears them, so the appeal is extracted and posted again.
+    '''
+
+    def __init__(self, path, max_attempts = POSTING_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # marked as posted from the uploader worker threads
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS learnings (
+            appeal_code TEXT NOT NULL,
+            excerpt_hash TEXT NOT NULL,
+            finding INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            posted_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            PRIMARY KEY (appeal_code, excerpt_hash, finding))''')
+        # journals written before failures were recorded
+        columns = [x[1] for x in self.connection.execute('PRAGMA table_info(learnings)')]
+        if 'attempts' not in columns:
+            self.connection.execute('ALTER TABLE learnings ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            self.connection.execute('ALTER TABLE learnings ADD COLUMN last_error TEXT')
+        self.connection.commit()
+
+    @staticmethod
+    def key(payload):
+        excerpt_hash = hashlib.sha256(payload['learning'].encode('utf-8')).hexdigest()
+        return (payload['appeal_code'], excerpt_hash, int(payload['type']))
+
+    def enqueue(self, payloads):
+        '''writes new learnings as pending; a failed learning is pending again when its payload changed'''
+        with self.lock:
+            self.connection.executemany('''INSERT INTO learnings (appeal_code, excerpt_hash, finding, payload, status) VALUES (?, ?, ?, ?, 'pending')
+                                           ON CONFLICT (appeal_code, excerpt_hash, finding) DO UPDATE
+                                           SET payload = excluded.payload, status = 'pending', attempts = 0, last_error = NULL
+                                           WHERE status = 'failed' AND payload != excluded.payload''',
+                                        [self.key(x) + (json.dumps(x, default = lambda value: value.item()),) for x in payloads])
+            self.connection.commit()
+
+    def mark_posted(self, payload):
+        with self.lock:
+            self.connection.execute("UPDATE learnings SET status = 'posted', posted_at = ? WHERE appeal_code = ? AND excerpt_hash = ? AND finding = ?",
+                                    (time.time(),) + self.key(payload))
+            self.connection.commit()
+
+    def mark_failed(self, payload, error, rejected = False):
+        '''counts a failed post; the learning is failed when rejected or out of attempts, pending otherwise'''
+        with self.lock:
+            self.connection.execute('''UPDATE learnings SET attempts = attempts + 1, last_error = ?,
+                                       status = CASE WHEN ? OR attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                                       WHERE appeal_code = ? AND excerpt_hash = ? AND finding = ?''',
+                                    (str(error), bool(rejected), self.max_attempts) + self.key(payload))
+            self.connection.commit()
+
+    def status(self, payload):
+        with self.lock:
+            row = self.connection.execute('SELECT status FROM learnings WHERE appeal_code = ? AND excerpt_hash = ? AND finding = ?', self.key(payload)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_posted(self, payload):
+        return self.status(payload) == 'posted'
+
+    def pending(self):
+        '''payloads of the learnings not posted yet, and not failed'''
+        with self.lock:
+            rows = self.connection.execute("SELECT payload FROM learnings WHERE status = 'pending' ORDER BY rowid").fetchall()
+        return [json.loads(x[0]) for x in rows]
+
+    def failed(self):
+        '''(appeal_code, attempts, last_error) of the failed learnings'''
+        with self.lock:
+            return self.connection.execute("SELECT appeal_code, attempts, last_error FROM learnings WHERE status = 'failed' ORDER BY rowid").fetchall()
+
+    def appeal_codes(self):
+        '''appeals with pending learnings, resumed from the journal rather than extracted again'''
+        with self.lock:
+            rows = self.connection.execute("SELECT DISTINCT appeal_code FROM learnings WHERE status = 'pending'").fetchall()
+        return {x[0] for x in rows}
+
+    def forget_posted(self, ops_learning_appeal_codes, posted_before):
+        '''clears the posted learnings of the appeals missing from ops_learning_appeal_codes, read from GO at
+        posted_before: later posts may not show in it yet. Returns the cleared appeals.'''
+        ops_learning_appeal_codes = set(ops_learning_appeal_codes)
+        with self.lock:
+            rows = self.connection.execute("SELECT DISTINCT appeal_code FROM learnings WHERE status = 'posted' AND posted_at < ?", (posted_before,)).fetchall()
+            missing = sorted(x[0] for x in rows if x[0] not in ops_learning_appeal_codes)
+            self.connection.executemany("DELETE FROM learnings WHERE status = 'posted' AND posted_at < ? AND appeal_code = ?", [(posted_before, x) for x in missing])
+            self.connection.commit()
+        return missing
+
+    def drop_failed(self, appeal_codes = None):
+        '''removes the failed learnings, of the given appeals only if set; returns how many were removed'''
+        with self.lock:
+            if appeal_codes is None:
+                cursor = self.connection.execute("DELETE FROM learnings WHERE status = 'failed'")
+            else:
+                cursor = self.connection.executemany("DELETE FROM learnings WHERE status = 'failed' AND appeal_code = ?", [(x,) for x in appeal_codes])
+            self.connection.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or (len(sys.argv) > 2 and sys.argv[2] != '--drop-failed'):
+        print("Usage: python posting_journal.py journal_path [--drop-failed [appeal_code ...]]")
+    else:
+        journal = PostingJournal(sys.argv[1])
+        for appeal_code, attempts, last_error in journal.failed():
+            print(appeal_code, attempts, last_error)
+        if len(sys.argv) > 2:
+            print(journal.drop_failed(sys.argv[3:] or None), 'failed learnings dropped')
+        journal.close()
@@ -0,0 +1,75 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import unicodedata
+
+DEFAULT_MAX_ENTRIES = 500000
+# sqlite limits the number of bound parameters per statement
+QUERY_CHUNK_SIZE = 500
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_excerpt(excerpt):
+    '''unicode-normalized excerpt with collapsed whitespace, so trivial variants share a cache entry'''
+    return WHITESPACE_PATTERN.sub(' ', unicodedata.normalize('NFKC', excerpt)).strip()
+
+
+class TagCache:
+    '''Persistent excerpt -> classifier tags cache, stored in SQLite.
+
+    Entries are keyed by a hash of the classifier version and the normalized excerpt,
+    so changing the model or endpoint starts from an empty cache. When there are more
+    than max_entries, the least recently used ones are evicted.
+    '''
+
+    def __init__(self, path, classifier_version, max_entries = DEFAULT_MAX_ENTRIES):
+        self.classifier_version = classifier_version
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tags (key TEXT PRIMARY KEY, tags TEXT NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tags_last_used ON tags (last_used)')
+        self.connection.commit()
+
+    def key(self, excerpt):
+        material = self.classifier_version + '\0' + normalize_excerpt(excerpt)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        '''returns {key: tags} for the keys found in the cache'''
+        keys = list(set(keys))
+        found = {}
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[start:start+QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT key, tags FROM tags WHERE key IN ({placeholders})', chunk)
+            found.update({key: json.loads(tags) for key, tags in rows})
+            self.connection.execute(f'UPDATE tags SET last_used = ? WHERE key IN ({placeholders})', [time.time()] + chunk)
+        self.connection.commit()
+
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        '''stores (key, tags) pairs, then evicts the least recently used entries above max_entries'''
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO tags (key, tags, last_used) VALUES (?, ?, ?)',
+                                    [(key, json.dumps(tags), now) for key, tags in items])
+        nb_entries = self.connection.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+        if nb_entries > self.max_entries:
+            evicted = nb_entries - self.max_entries
+            self.connection.execute('DELETE FROM tags WHERE key IN (SELECT key FROM tags ORDER BY last_used LIMIT ?)', (evicted,))
+            self.stats['evictions'] += evicted
+        self.connection.commit()
+
+    def log_stats(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / lookups if lookups else 0
+        logging.info('Tag cache: %s hits, %s misses (%.0f%% hit rate), %s evictions', self.stats['hits'], self.stats['misses'], 100 * hit_rate, self.stats['evictions'])
+
+    def close(self):
+        self.connection.close()
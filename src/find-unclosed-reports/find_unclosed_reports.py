@@ -3,30 +3,97 @@ import numpy as np
 import requests
 import json
 import sys
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import os
+# modules shared by the jobs, e.g. go_api_cache, live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import go_api_cache
+import pipeline_metrics
 
-def main(go_authorization_token_path, output_file_path):
+GO_API_URL = 'https://goadmin.ifrc.org/api/v2/'
+PAGE_LIMIT = 200
+FETCH_MAX_WORKERS = 8
+# appeal_document filter of the GO API used by the narrowed fetch
+APPEAL_CODE_FILTER = 'appeal_code'
+APPEAL_DOCUMENT_COLUMNS = ['appeal', 'name', 'type', 'document_url']
+
+def main(go_authorization_token_path, output_file_path, narrow_appeal_documents = True):
     with open(go_authorization_token_path) as json_file:
         go_authorization_token = json.load(json_file)
 
+    cache = go_api_cache.from_env()
+
         
+    # one pooled session shared by the tables and pages fetched concurrently
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = FETCH_MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    pool = ThreadPoolExecutor(max_workers = FETCH_MAX_WORKERS)
+
     def fetch_url(field):
-        return requests.get(field,headers = go_authorization_token).json()
+        return go_api_cache.get(field, headers = go_authorization_token, session = session, cache = cache).json()
 
     
-    def fetch_field(field):
-        dict_field = []
-        temp_dict = requests.get('https://goadmin.ifrc.org/api/v2/'+field+'/?limit=200/', headers = go_authorization_token).json()
+    def fetch_pages(url, first_page = None):
+        '''rows of every page of url: the first page gives the count, the other pages are fetched concurrently by offset and kept in order'''
+        temp_dict = first_page or fetch_url(url)
+        dict_field = list(temp_dict['results'])
+        if temp_dict['next']:
+            offsets = range(PAGE_LIMIT, temp_dict['count'], PAGE_LIMIT)
+            for page in pool.map(lambda offset: fetch_url(url+'&offset='+str(offset)), offsets):
+                dict_field.extend(page['results'])
+        return dict_field
+
+    
+    def fetch_field(field, params = ''):
         try:
-            while temp_dict['next']:
-                dict_field.extend(temp_dict['results'])
-                temp_dict = fetch_url(temp_dict['next'])
-            dict_field.extend(temp_dict['results'])
-            return pd.DataFrame.from_dict(dict_field)
+            return pd.DataFrame.from_dict(fetch_pages(GO_API_URL+field+'/?limit='+str(PAGE_LIMIT)+params))
         except:
             print('Problem accessing the table: ', field)
             print('========================')
             return None
 
+
+    def fetch_appeal_documents(appeal_codes):
+        '''appeal documents of the given appeals, one filtered query per appeal.
+        Falls back to the whole table when GO ignores the appeal code filter.
+        The documents are not filtered by name on the server, the "final" name mask is applied afterwards.'''
+        def fetch_appeal(code):
+            url = GO_API_URL+'appeal_document/?limit='+str(PAGE_LIMIT)+'&'+APPEAL_CODE_FILTER+'='+quote(code)
+            try:
+                first_page = fetch_url(url)
+                if not all(code in x['appeal']['code'] for x in first_page['results']):
+                    # the filter was ignored, GO answered with documents of other appeals
+                    return None
+                documents = pd.DataFrame.from_dict(fetch_pages(url, first_page))
+            except:
+                return None
+            if documents.empty:
+                return documents
+            # the filter may match codes containing this one, keep the exact ones
+            return documents[[x['code'] == code for x in documents['appeal']]]
+        
+        appeal_codes = list(dict.fromkeys(appeal_codes))
+        if not appeal_codes:
+            # no unpublished final report, no document to look for
+            return pd.DataFrame(columns = APPEAL_DOCUMENT_COLUMNS)
+        # the first appeal alone shows whether GO honours the filter, before querying the others
+        first = fetch_appeal(appeal_codes[0])
+        if first is None:
+            print('Filtering appeal documents by appeal code is not available, fetching the whole table')
+            return fetch_field('appeal_document')
+        with ThreadPoolExecutor(max_workers = FETCH_MAX_WORKERS) as appeal_pool:
+            documents = [first] + list(appeal_pool.map(fetch_appeal, appeal_codes[1:]))
+        if any(x is None for x in documents):
+            print('Filtering appeal documents by appeal code is not available, fetching the whole table')
+            return fetch_field('appeal_document')
+        documents = [x for x in documents if not x.empty]
+        if not documents:
+            return pd.DataFrame(columns = APPEAL_DOCUMENT_COLUMNS)
+        return pd.concat(documents, ignore_index = True)
+
         
     def fetch_unpublished_final_report(go_fr, ifrc_published_reports, go_region):
         '''get final reports that have not been published in GO'''
@@ -41,12 +108,15 @@ def main(go_authorization_token_path, output_file_path):
         appeal_code_list = list(go_fr_uc['appeal_code'])  
     
         '''get final reports that have been published in IFRC'''
-        ifrc_published_reports['appeal_code'] = [x['code'] for x in ifrc_published_reports['appeal']]
-        mask_1 = [x in appeal_code_list for x in ifrc_published_reports['appeal_code']]
-        mask_2 = ['final' in x.lower() for x in (ifrc_published_reports['name'])]
-        mask_3 = ['final' in x.lower() if pd.notna(x) else True for x in ifrc_published_reports['type']]
+        # map keeps the column text when there are no documents, a list of codes would make it float
+        ifrc_published_reports['appeal_code'] = ifrc_published_reports['appeal'].map(lambda x: x['code'])
+        # isin hashes the unpublished appeal codes once, instead of scanning the list for every document
+        mask_1 = ifrc_published_reports['appeal_code'].isin(appeal_code_list)
+        mask_2 = ifrc_published_reports['name'].str.lower().str.contains('final', regex = False, na = False)
+        # documents without a type are kept
+        mask_3 = ifrc_published_reports['type'].str.lower().str.contains('final', regex = False, na = True)
     
-        mask = [(x and (y and z)) for x,y,z in zip(mask_1,mask_2,mask_3)]
+        mask = mask_1 & mask_2 & mask_3
         ifrc_final_published = ifrc_published_reports[mask]
     
         go_fr_uc = pd.merge(go_fr_uc,ifrc_final_published[['appeal_code','document_url']])
@@ -59,20 +129,40 @@ def main(go_authorization_token_path, output_file_path):
         return go_fr_uc.to_excel(file_name, index = False)
 
     
-    go_fr = fetch_field('dref-final-report')
-    ifrc_published_reports = fetch_field('appeal_document')
-    go_region = fetch_field('region')
-    
-    if go_fr is not None:
-        unpublished_reports = fetch_unpublished_final_report(go_fr,ifrc_published_reports,go_region)
-        publish_findings(unpublished_reports, output_file_path)
+    metrics = pipeline_metrics.from_env('find_unclosed_reports')
+    with metrics.run():
+        with metrics.stage('fetch') as stage:
+            if narrow_appeal_documents:
+                # only the documents of the unpublished final reports are fetched, once these are known
+                with ThreadPoolExecutor(max_workers = 2) as table_pool:
+                    go_fr, go_region = table_pool.map(fetch_field, ['dref-final-report', 'region'])
+                if go_fr is not None:
+                    ifrc_published_reports = fetch_appeal_documents(go_fr[go_fr['is_published'] == False]['appeal_code'])
+            else:
+                # the three tables are fetched at the same time, on their own threads
+                with ThreadPoolExecutor(max_workers = 3) as table_pool:
+                    go_fr, ifrc_published_reports, go_region = table_pool.map(fetch_field, ['dref-final-report', 'appeal_document', 'region'])
+            stage.rows_out = len(go_fr) if go_fr is not None else 0
+        
+        if go_fr is not None:
+            with metrics.stage('filter', rows_in = len(go_fr)) as stage:
+                unpublished_reports = fetch_unpublished_final_report(go_fr,ifrc_published_reports,go_region)
+                stage.rows_out = len(unpublished_reports)
+            with metrics.stage('publish', rows_in = len(unpublished_reports)) as stage:
+                publish_findings(unpublished_reports, output_file_path)
+                stage.rows_out = len(unpublished_reports)
 
-        if not unpublished_reports.empty:
-            print('Reports published successfully!')
+            if not unpublished_reports.empty:
+                print('Reports published successfully!')
+            else:
+                print('No unpublished reports found.')
         else:
-            print('No unpublished reports found.')
-    else:
-        print('No data fetched or an error occurred while fetching data.')
+            print('No data fetched or an error occurred while fetching data.')
+
+    pool.shutdown()
+    session.close()
+    if cache is not None:
+        cache.log_stats()
 
 
 if __name__ == "__main__":
@@ -5,6 +5,10 @@ import json
 import sys
 from ast import literal_eval
 import logging
+import os
+# modules shared by the jobs, e.g. go_api_cache, live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import go_api_cache
 
 
 # Configure logging
@@ -43,10 +47,10 @@ def export_as_json(data, output_file_path):
     logging.info(f"Data successfully exported to {output_file_path}")
 
 
-def fetch_json_data(url, headers):
-    """Fetches JSON data from a URL with optional headers."""
+def fetch_json_data(url, headers, cache=None):
+    """Fetches JSON data from a URL with optional headers, through the response cache if given."""
     try:
-        response = requests.get(url, headers=headers)
+        response = go_api_cache.get(url, headers=headers, cache=cache)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -54,13 +58,13 @@ def fetch_json_data(url, headers):
         raise
 
 
-def fetch_paginated_data(endpoint, headers, limit=200):
+def fetch_paginated_data(endpoint, headers, limit=200, cache=None):
     """Fetches paginated data from a given API endpoint and returns a DataFrame."""
     url = f"{API_BASE_URL}{endpoint}/?limit={limit}"
     data_list = []
     
     while url:
-        data_chunk = fetch_json_data(url, headers)
+        data_chunk = fetch_json_data(url, headers, cache)
         data_list.extend(data_chunk.get('results', []))
         url = data_chunk.get('next')
         logging.info(f"Fetched {len(data_chunk.get('results', []))} records from {endpoint}")
@@ -143,11 +147,12 @@ def generate_prioritization_list(go_authorization_token_path,output_country_path
     """Generates and exports prioritization lists for country, regional, and global levels."""
     auth_token = read_json_file(go_authorization_token_path)
     headers = {'Authorization': auth_token['Authorization']}
+    cache = go_api_cache.from_env()
 
 
-    country_df = fetch_paginated_data('country', headers)
-    per_overview_df = fetch_paginated_data('per-overview', headers)
-    per_prioritization_df = fetch_paginated_data('public-per-prioritization', headers)
+    country_df = fetch_paginated_data('country', headers, cache=cache)
+    per_overview_df = fetch_paginated_data('per-overview', headers, cache=cache)
+    per_prioritization_df = fetch_paginated_data('public-per-prioritization', headers, cache=cache)
 
 
     country_df = preprocess_country_data(country_df)
@@ -164,6 +169,8 @@ def generate_prioritization_list(go_authorization_token_path,output_country_path
     export_as_json(global_list, output_global_path)
 
     logging.info("Generation of prioritization lists completed.")
+    if cache is not None:
+        cache.log_stats()
 
                                 
 def main(go_authorization_token_path,output_country_file_path, output_region_file_path, output_global_file_path):
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import hashlib
+import logging
+import threading
+
+
+CACHE_DIR_ENV = "QUERY_CACHE_DIR"
+CACHE_TTL_ENV = "QUERY_CACHE_TTL"
+CACHE_MAX_BYTES_ENV = "QUERY_CACHE_MAX_BYTES"
+DEFAULT_TTL = 900
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def canonical_filter(request_filter):
+    """The filter with its keys sorted and empty values dropped, as build_filtered_learning_url sends it."""
+    return {k: request_filter[k] for k in sorted(request_filter) if request_filter[k]}
+
+
+def filter_key(request_filter):
+    material = json.dumps(canonical_filter(request_filter), sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf8')).hexdigest()
+
+
+class QueryCache:
+    """On-disk cache of query results, keyed by the canonical request filter.
+
+    Each filter has a pickled DataFrame under results/ and a small entry under
+    entries/ with the freshness of the data it was built from: the filtered count
+    and the latest modified_at. Entries younger than the TTL are served directly;
+    older ones are served once a cheap freshness check matches what they were
+    built from, otherwise the query runs again. When the results exceed max_bytes,
+    the least recently used filters are evicted.
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'results'), exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, 'entries', key + '.json')
+
+    def _result_path(self, key):
+        return os.path.join(self.cache_dir, 'results', key + '.pkl')
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _read_result(self, key):
+        try:
+            with open(self._result_path(key), 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write_entry(self, key, entry):
+        self._write_atomic(self._entry_path(key), json.dumps(entry).encode('utf8'))
+
+    def _store(self, key, request_filter, freshness, df):
+        data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        entry = {
+            'filter': canonical_filter(request_filter),
+            'freshness': freshness,
+            'size': len(data),
+            'stored_at': time.time(),
+        }
+        with self._lock:
+            # the result is written first, an entry always points at a complete result
+            self._write_atomic(self._result_path(key), data)
+            self._write_entry(key, entry)
+            self._evict()
+
+    def _evict(self):
+        """Drops least recently used filters until the results fit in max_bytes (lock held)."""
+        entry_dir = os.path.join(self.cache_dir, 'entries')
+        entries = []
+        for name in os.listdir(entry_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(entry_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), name[:-len('.json')], os.path.getsize(self._result_path(name[:-len('.json')]))))
+            except FileNotFoundError:
+                continue
+        total_bytes = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            for path in [self._entry_path(key), self._result_path(key)]:
+                if os.path.exists(path):
+                    os.remove(path)
+            total_bytes -= size
+            self.stats['evictions'] += 1
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get(self, request_filter, fetch, check_freshness):
+        """Result of fetch() for request_filter, served from the cache when fresh or revalidated.
+
+        check_freshness() returns the current [count, latest modified_at] of the
+        filter; it is only called once the entry is older than the TTL, and before
+        fetch() when the query runs, so a change during the fetch shows on the next check.
+        """
+        key = filter_key(request_filter)
+        entry = self._read_entry(key)
+
+        if entry is not None and time.time() - entry['stored_at'] < self.ttl:
+            df = self._read_result(key)
+            if df is not None:
+                self._count('hits')
+                os.utime(self._entry_path(key))
+                return df
+
+        freshness = check_freshness()
+        if entry is not None and entry['freshness'] == freshness:
+            df = self._read_result(key)
+            if df is not None:
+                self._count('revalidated')
+                entry['stored_at'] = time.time()
+                with self._lock:
+                    self._write_entry(key, entry)
+                return df
+
+        self._count('misses')
+        df = fetch()
+        self._store(key, request_filter, freshness, df)
+        return df
+
+    def log_stats(self):
+        queries = self.stats['hits'] + self.stats['revalidated'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] + self.stats['revalidated']) / queries if queries else 0
+        logging.info(f"Query cache: {self.stats['hits']} hits, {self.stats['revalidated']} revalidated, "
+                     f"{self.stats['misses']} misses ({hit_rate:.0%} served locally), {self.stats['evictions']} evictions")
+
+
+def from_env():
+    """Returns a QueryCache when QUERY_CACHE_DIR is set, otherwise None (caching disabled)."""
+    cache_dir = os.getenv(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    ttl = float(os.getenv(CACHE_TTL_ENV, DEFAULT_TTL))
+    max_bytes = int(os.getenv(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+    return QueryCache(cache_dir, ttl=ttl, max_bytes=max_bytes)
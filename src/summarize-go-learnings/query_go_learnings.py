@@ -4,12 +4,57 @@ import requests
 import json
 import sys
 import io
+import csv
+import math
+import itertools
+from urllib.parse import urlencode, quote_plus
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import os
+# modules shared by the jobs, e.g. go_api_cache, live in src/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import go_api_cache
+import query_cache
+import ops_learning_mirror
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    # the CSV pages are then parsed page by page with pandas
+    pa = None
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
+# CSV pages downloaded at the same time
+FETCH_MAX_WORKERS = 8
+# longest GET URL sent to GO, well within the limits of common servers and proxies
+MAX_URL_LENGTH = 2000
+# sub-queries of a split filter running at the same time, their pages share FETCH_MAX_WORKERS
+SUBQUERY_MAX_WORKERS = 4
+OPS_LEARNING_API_URL = 'https://goadmin.ifrc.org/api/v2/ops-learning/?'
+
+# types of the ops-learning CSV export columns; other columns are read as strings,
+# so every page has the same schema whatever its values
+OPS_LEARNING_CSV_TYPES = {
+    'id': 'int',
+    'appeal_year': 'int',
+    'country_id': 'int',
+    'region_id': 'int',
+    'country': 'category',
+    'country_name': 'category',
+    'region': 'category',
+    'region_name': 'category',
+    'component': 'category',
+    'sector': 'category',
+}
+
+# export columns holding the values of GO filter keys, filters differing only in keys
+# on these columns share one query in query_many and are sliced from its result
+SLICE_COLUMNS = ['appeal_code', 'country_id', 'region_id']
+
 
 def read_json_file(file_path):
     """Reads a JSON file and returns its content as a dictionary."""
@@ -33,10 +78,10 @@ def validate_df_not_empty(df):
     else:
         return True
 
-def fetch_data_from_url(url):
+def fetch_data_from_url(url, cache=None, session=None):
     """Fetches data from a given URL and returns it as a DataFrame."""
     try:
-        response = requests.get(url)
+        response = go_api_cache.get(url, session=session, cache=cache)
         response.raise_for_status()
         logging.info(f"Data fetched from URL: {url}")
         return pd.read_csv(io.StringIO(response.content.decode('utf8')))
@@ -48,50 +93,396 @@ def fetch_data_from_url(url):
         raise
 
 
+def arrow_column_type(column):
+    column_type = OPS_LEARNING_CSV_TYPES.get(column)
+    if column_type == 'int':
+        return pa.int64()
+    if column_type == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def read_csv_table(stream):
+    """Parses a CSV body incrementally from a binary stream into an Arrow table with the ops-learning types."""
+    # buffered, to look past the header whatever the transfer and content encodings of the body
+    stream = io.BufferedReader(stream)
+    header = stream.readline().decode('utf-8-sig')
+    if not header.strip():
+        return None
+    column_names = next(csv.reader([header]))
+    column_types = {x: arrow_column_type(x) for x in column_names}
+    if not stream.peek(1).strip():
+        # a page with no rows, Arrow refuses an empty CSV body
+        return pa.table({x: pa.array([], type=column_types[x]) for x in column_names})
+    reader = pa_csv.open_csv(
+        stream,
+        read_options=pa_csv.ReadOptions(column_names=column_names),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True))
+    return reader.read_all()
+
+
+def fetch_table_from_url(url, cache=None, session=None):
+    """Fetches a CSV page as an Arrow table, streaming the body into the parser when it is not cached."""
+    try:
+        if cache is None:
+            response = (session or requests).get(url, stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # closed below, the buffered reader reads ahead of the parser
+            response.raw.auto_close = False
+            table = read_csv_table(response.raw)
+            response.close()
+        else:
+            response = go_api_cache.get(url, session=session, cache=cache)
+            response.raise_for_status()
+            table = read_csv_table(io.BytesIO(response.content))
+        logging.info(f"Data fetched from URL: {url}")
+        return table
+    except requests.exceptions.RequestException as e:
+        logging.error(f"HTTP request exception: {e}")
+        raise
+    except pa.ArrowInvalid as e:
+        logging.error(f"Arrow parsing exception: {e}")
+        raise
+
+
+def table_to_dataframe(tables):
+    """Concatenates the page tables without copying, then converts once, with nullable ints and categoricals."""
+    tables = [x for x in tables if x is not None]
+    if not tables:
+        return pd.DataFrame()
+    table = pa.concat_tables(tables, promote_options='permissive')
+    df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get, split_blocks=True, self_destruct=True)
+    # dictionaries keep the values in order of appearance, sorting by these columns stays alphabetical
+    for column in df.select_dtypes('category').columns:
+        df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
+
+
+def pandas_csv_dtypes():
+    return {k: ('Int64' if v == 'int' else 'category') for k, v in OPS_LEARNING_CSV_TYPES.items()}
+
+
+def filter_param(value):
+    """Filter value as GO takes it in the URL, lists of values comma separated."""
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(x) for x in value)
+    return value
+
+
+def filtered_learning_url(request_filter, limit=200):
+    params = {k: filter_param(v) for k, v in request_filter.items() if v}
+    params['limit'] = limit
+    return OPS_LEARNING_API_URL + urlencode(params)
+
+
 def build_filtered_learning_url(request_filter, limit=200):
     """Constructs the API URL with given filters and limit."""
-    base_url = 'https://goadmin.ifrc.org/api/v2/ops-learning/?'
-    request_filter = {k: v for k, v in request_filter.items() if v}
-    params = '&'.join([f"{k}={v}" for k, v in request_filter.items()])
-    url = f"{base_url}{params}&limit={limit}"
+    url = filtered_learning_url(request_filter, limit)
     logging.info(f"URL built: {url}")
     return url
-    
-    
-def fetch_filtered_learnings_csvexport(request_filter, limit=200):
-    """Fetches filtered learning data and returns it as a pandas DataFrame."""
+
+
+def page_url_length(request_filter, limit=200):
+    """Length of the longest CSV page URL of the filter."""
+    return len(filtered_learning_url(request_filter, limit)) + len('&format=csv&offset=') + 10
+
+
+def in_filter_batches(values, budget):
+    """Values in batches whose comma separated, URL encoded list fits in budget characters."""
+    separator_length = len(quote_plus(','))
+    batches, batch, length = [], [], 0
+    for value in values:
+        value_length = len(quote_plus(str(value)))
+        if batch and length + separator_length + value_length > budget:
+            batches.append(batch)
+            batch, length = [], 0
+        length += value_length + (separator_length if batch else 0)
+        batch.append(value)
+    batches.append(batch)
+    return batches
+
+
+def plan_queries(request_filter, limit=200, max_length=MAX_URL_LENGTH):
+    """Sub-filters whose URLs fit in max_length and which together select the learnings of request_filter.
+
+    Each __in list gets a share of the URL length left by the other filters: lists
+    shorter than an equal share keep all their values, the longer ones share the
+    rest equally and are split in batches that fit. There is a sub-filter for every
+    combination of batches.
+    """
+    if page_url_length(request_filter, limit) <= max_length:
+        return [request_filter]
+    in_values = {k: ops_learning_mirror.filter_values(v) for k, v in request_filter.items() if k.endswith('__in') and v}
+    if not in_values:
+        logging.warning(f"Filter URL longer than {max_length} characters, and no __in filter to split")
+        return [request_filter]
+
+    # the URL with every __in list replaced by a one character value
+    fixed_length = page_url_length(dict(request_filter, **{k: 'x' for k in in_values}), limit) - len(in_values)
+    available = max_length - fixed_length
+    lengths = {k: len(quote_plus(filter_param(v))) for k, v in in_values.items()}
+    batches = {}
+    for i, key in enumerate(sorted(in_values, key=lengths.get)):
+        budget = min(lengths[key], available // (len(in_values) - i))
+        available -= budget
+        batches[key] = in_filter_batches(in_values[key], budget)
+
+    sub_filters = [dict(request_filter, **dict(zip(batches, x))) for x in itertools.product(*batches.values())]
+    if any(page_url_length(x, limit) > max_length for x in sub_filters):
+        logging.warning(f"Some sub-query URLs stay longer than {max_length} characters")
+    return sub_filters
+
+
+def make_session(max_workers=FETCH_MAX_WORKERS):
+    """Session keeping one connection alive per worker."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_filtered_learnings_csvexport(request_filter, limit=200, cache=None, max_workers=FETCH_MAX_WORKERS):
+    """Fetches filtered learning data and returns it as a pandas DataFrame.
+
+    The count is read from a one-row JSON page, then the CSV pages are downloaded
+    concurrently over a pooled session and concatenated in offset order.
+    """
     url = build_filtered_learning_url(request_filter, limit)
+    session = make_session(max_workers)
     try:
-        total_count = requests.get(url).json().get('count', 0)
-        logging.info(f"Total records: {total_count}")
+        total_count = go_api_cache.get(build_filtered_learning_url(request_filter, 1), session=session, cache=cache).json().get('count', 0)
+        # an empty result still needs one page, for the CSV header
+        nb_pages = max(1, math.ceil(total_count / limit))
+        logging.info(f"Total records: {total_count}, fetching {nb_pages} pages")
 
-        dataframes = [fetch_data_from_url(f"{url}&format=csv&offset={i * limit}") 
-                      for i in range((total_count // limit) + 1)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            if pa is not None:
+                tables = list(pool.map(lambda i: fetch_table_from_url(f"{url}&format=csv&offset={i * limit}", cache, session),
+                                       range(nb_pages)))
+                return table_to_dataframe(tables)
+
+            dataframes = list(pool.map(lambda i: fetch_data_from_url(f"{url}&format=csv&offset={i * limit}", cache, session),
+                                       range(nb_pages)))
         
         combined_df = pd.concat(dataframes, ignore_index=True)
-        return combined_df
+        # categories differ between pages, so they are set on the combined frame
+        dtypes = {k: v for k, v in pandas_csv_dtypes().items() if k in combined_df.columns}
+        return combined_df.astype(dtypes)
 
     except Exception as e:
         logging.error(f"Unexpected exception: {e}")
         raise
+    finally:
+        session.close()
+
+
+def merge_subquery_results(dataframes):
+    """Concatenates sub-query results, keeping the rows of a learning from the first sub-query that returned it."""
+    dataframes = [x for x in dataframes if not x.empty]
+    if not dataframes:
+        return pd.DataFrame()
+    seen_ids, parts = set(), []
+    for df in dataframes:
+        parts.append(df[~df['id'].isin(seen_ids)])
+        seen_ids.update(df['id'])
+    combined_df = pd.concat(parts, ignore_index=True)
+    # categories differ between sub-queries, so they are set on the combined frame
+    dtypes = {k: v for k, v in pandas_csv_dtypes().items() if k in combined_df.columns}
+    return combined_df.astype(dtypes)
+
+
+def fetch_filtered_learnings(request_filter, limit=200, cache=None, max_workers=FETCH_MAX_WORKERS):
+    """Fetches filtered learnings, splitting filters whose URL would be too long in concurrent sub-queries."""
+    sub_filters = plan_queries(request_filter, limit)
+    if len(sub_filters) == 1:
+        return fetch_filtered_learnings_csvexport(request_filter, limit, cache=cache, max_workers=max_workers)
+
+    nb_workers = min(SUBQUERY_MAX_WORKERS, len(sub_filters))
+    logging.info(f"Filter split in {len(sub_filters)} sub-queries, {nb_workers} at a time")
+    with ThreadPoolExecutor(max_workers=nb_workers) as pool:
+        dataframes = list(pool.map(lambda x: fetch_filtered_learnings_csvexport(x, limit, cache=cache, max_workers=max(1, max_workers // nb_workers)),
+                                   sub_filters))
+    return merge_subquery_results(dataframes)
+
+
+def fetch_freshness(request_filter):
+    """Count and latest modified_at of the filtered learnings, from a one-row JSON page per sub-query.
+
+    Always asks the API, the response cache would hide a change until its own TTL.
+    """
+    freshness = []
+    for sub_filter in plan_queries(request_filter):
+        url = build_filtered_learning_url(sub_filter, 1) + '&ordering=-modified_at'
+        response = requests.get(url)
+        response.raise_for_status()
+        data = response.json()
+        latest = (data.get('results') or [{}])[0].get('modified_at')
+        freshness.append([data.get('count', 0), latest])
+    return freshness[0] if len(freshness) == 1 else freshness
+
+
+def sync_mirror(mirror):
+    """Syncs the local ops-learning mirror; False when it has no data to query."""
+    try:
+        mirror.sync()
+    except requests.exceptions.RequestException as e:
+        if mirror.is_empty():
+            logging.warning(f"Ops-learning mirror could not be synced: {e}")
+            return False
+        logging.warning(f"Ops-learning mirror could not be synced, querying the local copy: {e}")
+    return True
+
+
+def query_mirror(request_filter, mirror, sync=True):
+    """Learnings of the filter from the local ops-learning mirror, or None when the mirror cannot answer it."""
+    if sync and not sync_mirror(mirror):
+        return None
+    try:
+        df = mirror.query(request_filter)
+    except ops_learning_mirror.UnsupportedFilterError as e:
+        logging.info(f"{e}, querying GO")
+        return None
+    logging.info(f"{len(df)} learnings queried from the local ops-learning mirror")
+    return df.astype({k: v for k, v in pandas_csv_dtypes().items() if k in df.columns})
+
+
+def query_go(request_filter):
+    """Learnings of the filter from the GO CSV export, through the query results cache when enabled."""
+    cache = go_api_cache.from_env()
+    results_cache = query_cache.from_env()
+    if results_cache is not None:
+        df = results_cache.get(request_filter,
+                               lambda: fetch_filtered_learnings(request_filter, cache=cache),
+                               lambda: fetch_freshness(request_filter))
+        results_cache.log_stats()
+    else:
+        df = fetch_filtered_learnings(request_filter, cache=cache)
+    if cache is not None:
+        cache.log_stats()
+    return df
+
+
+def index_learnings(df):
+    if validate_df_not_empty(df):
+        df['excerpts_id'] = [str(x) for x in df['id']]
+        df.set_index('id', inplace=True)
+        logging.info("Data successfully fetched and returned as DataFrame.")
+    return df
 
 
 def query(request_filter_path):
     """Fetches the data based on the filter and writes it to a CSV file."""
     try:
         request_filter = read_json_file(request_filter_path)
-        df = fetch_filtered_learnings_csvexport(request_filter)
-
-        if validate_df_not_empty(df):
-            df['excerpts_id'] = [str(x) for x in df['id']]
-            df.set_index('id', inplace=True)
-            logging.info("Data successfully fetched and returned as DataFrame.")
-        return df
+        mirror = ops_learning_mirror.from_env()
+        df = query_mirror(request_filter, mirror) if mirror is not None else None
+        if df is None:
+            df = query_go(request_filter)
+        return index_learnings(df)
     except Exception as e:
         logging.error(f"Failed to query data: {e}")
         return pd.DataFrame()
 
 
+def union_filter(request_filters):
+    """A filter selecting the learnings of every filter: keys equal in all of them, and __in keys with all their values.
+
+    Other keys are left out, so the union may select more than the filters together.
+    """
+    request_filters = [query_cache.canonical_filter(x) for x in request_filters]
+    union = {}
+    for key in sorted(set.intersection(*[set(x) for x in request_filters])):
+        values = [x[key] for x in request_filters]
+        if all(x == values[0] for x in values):
+            union[key] = values[0]
+        elif key.endswith('__in'):
+            union[key] = list(dict.fromkeys(v for x in values for v in ops_learning_mirror.filter_values(x)))
+    return union
+
+
+def sliceable_key(key):
+    """Whether a filter key can be evaluated on the export columns, in memory."""
+    try:
+        column, _ = ops_learning_mirror.key_column(key)
+    except ops_learning_mirror.UnsupportedFilterError:
+        return False
+    return column in SLICE_COLUMNS
+
+
+def group_filters(request_filters):
+    """Indexes of the filters grouped by their keys that cannot be sliced: each group can share one query."""
+    groups = {}
+    for i, request_filter in enumerate(request_filters):
+        fixed = {k: v for k, v in query_cache.canonical_filter(request_filter).items() if not sliceable_key(k)}
+        groups.setdefault(json.dumps(fixed, sort_keys=True, default=str), []).append(i)
+    return list(groups.values())
+
+
+def slice_learnings(df, union, request_filter):
+    """Learnings of request_filter within the learnings of the union filter, or None when the export columns cannot tell."""
+    remaining = {k: v for k, v in query_cache.canonical_filter(request_filter).items() if union.get(k) != v}
+    if 'search' in remaining:
+        # GO searches fields that are not in the export
+        return None
+    if df.empty:
+        return df.copy()
+    try:
+        df = df[ops_learning_mirror.filter_mask(df, remaining)].copy()
+    except ops_learning_mirror.UnsupportedFilterError as e:
+        logging.info(f"{e}")
+        return None
+    for column in df.select_dtypes('category').columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df.reset_index(drop=True)
+
+
+def query_many(request_filters):
+    """Learnings of each filter, from one data pull shared by all of them, or None for the filters that failed.
+
+    With the local mirror, every filter is evaluated on it after one sync. Otherwise
+    the filters differing only in keys on SLICE_COLUMNS are grouped, the union of each
+    group is queried once from GO and sliced for each of its filters in memory; a
+    filter alone in its group, or that cannot be sliced, is queried on its own, as are
+    the filters of a group whose union failed. A filter that fails does not stop the others.
+    """
+    results = [None] * len(request_filters)
+
+    def settle(i, fetch, source):
+        try:
+            df = fetch()
+            results[i] = index_learnings(df) if df is not None else None
+        except Exception as e:
+            logging.error(f"Failed to query data of filter {i} from {source}: {e}")
+
+    mirror = ops_learning_mirror.from_env()
+    if mirror is not None and sync_mirror(mirror):
+        for i, request_filter in enumerate(request_filters):
+            settle(i, lambda: query_mirror(request_filter, mirror, sync=False), 'the local ops-learning mirror')
+
+    pending = [i for i, x in enumerate(results) if x is None]
+    for group in group_filters([request_filters[i] for i in pending]):
+        group = [pending[i] for i in group]
+        if len(group) > 1:
+            union = union_filter([request_filters[i] for i in group])
+            logging.info(f"Querying the union of {len(group)} filters once: {union}")
+            try:
+                union_df = query_go(union)
+            except Exception as e:
+                logging.error(f"Failed to query the union of {len(group)} filters, querying them on their own: {e}")
+                union_df = None
+            if union_df is not None:
+                for i in group:
+                    settle(i, lambda: slice_learnings(union_df, union, request_filters[i]), 'the union')
+                    if results[i] is None:
+                        logging.info(f"Filter {i} cannot be sliced from the union, querying it on its own")
+        for i in group:
+            if results[i] is None:
+                settle(i, lambda: query_go(request_filters[i]), 'GO')
+    return results
+
+
 def main(request_filter_path):
     """Main function to execute the query and return the DataFrame."""
     return query(request_filter_path)
@@ -1,8 +1,10 @@
+import os
 import time
 from datetime import datetime
 import sys
 import logging
-from query_go_learnings import query
+from concurrent.futures import ThreadPoolExecutor
+from query_go_learnings import query, query_many, read_json_file
 from generate_prioritization_lists import generate_prioritization_list
 from prioritize_components_go_learnings import prioritize_components
 from contextualize_go_learnings import contextualize
@@ -12,6 +14,10 @@ from generate_summaries_go_learnings import generate_summaries
 from process_summaries_go_learnings import process_summary
 
 
+# filters summarized at the same time in batch mode, each makes its LLM calls one after the other
+SUMMARY_MAX_WORKERS = 4
+
+
 def summarize(request_filter_path, primary_output_file_path, secondary_output_file_path):
     """Summarizes the learnings based on the request filter."""
     start_time = time.time()
@@ -25,55 +31,98 @@ def summarize(request_filter_path, primary_output_file_path, secondary_output_fi
         filtered_learnings = query(request_filter_path)
         logging.info("Queried and filtered learnings.")
 
-        # Uncomment if needed for generating prioritization lists
-        # generate_prioritization_list("../../../../../data/go/go_authorization_token.json", "list_components_countries.json", "list_components_regions.json", "list_components_global.json")
-        # logging.info("Prioritized components lists generated.")
+        summarize_learnings(request_filter_path, filtered_learnings, primary_output_file_path, secondary_output_file_path)
 
-        contextualized_learnings = contextualize(filtered_learnings)
-        logging.info("Contextualized the learnings.")
+        logging.info("Complete summarization process done in %s seconds.", time.time() - start_time)
 
-        prioritized_components_learnings = prioritize_components(
-            contextualized_learnings, 
-            "list_components_countries.json", 
-            "list_components_regions.json", 
-            "list_components_global.json"
-        )
-        logging.info("Prioritized components learnings.")        
+        
+    except Exception as e:
+        logging.error("An error occurred during the summarization process: %s", e)
+        raise
 
-        primary_prioritized_learnings = prioritize_excerpts(prioritized_components_learnings,"primary")
-        logging.info("Prioritized excerpts from learnings for primary summary.")
 
-        primary_prompt = format_prompt(request_filter_path, primary_prioritized_learnings,"primary")
-        logging.info("Formatted the prompt for primary summary.")
-        logging.info(primary_prompt)
+def summarize_learnings(request_filter_path, filtered_learnings, primary_output_file_path, secondary_output_file_path):
+    """Writes the primary and secondary summaries of the learnings queried for the request filter."""
+    # Uncomment if needed for generating prioritization lists
+    # generate_prioritization_list("../../../../../data/go/go_authorization_token.json", "list_components_countries.json", "list_components_regions.json", "list_components_global.json")
+    # logging.info("Prioritized components lists generated.")
 
-        generate_summaries(primary_prompt, primary_output_file_path)
-        logging.info("Generated the primary summary.")
+    contextualized_learnings = contextualize(filtered_learnings)
+    logging.info("Contextualized the learnings.")
 
-        process_summary(primary_output_file_path,"primary", 3)
-        logging.info("Finalized processing primary summary.")
-        logging.info("%s learnings retrieved, %s learnings prioritized.", len(filtered_learnings),len(primary_prioritized_learnings))
+    prioritized_components_learnings = prioritize_components(
+        contextualized_learnings, 
+        "list_components_countries.json", 
+        "list_components_regions.json", 
+        "list_components_global.json"
+    )
+    logging.info("Prioritized components learnings.")        
 
-        secondary_prioritized_learnings = prioritize_excerpts(contextualized_learnings,"secondary")
-        logging.info("Prioritized excerpts from learnings for secondary summary.")
+    primary_prioritized_learnings = prioritize_excerpts(prioritized_components_learnings,"primary")
+    logging.info("Prioritized excerpts from learnings for primary summary.")
 
-        secondary_prompt = format_prompt(request_filter_path, secondary_prioritized_learnings,"secondary")
-        logging.info("Formatted the prompt for secondary summary.")
-        logging.info(secondary_prompt)
+    primary_prompt = format_prompt(request_filter_path, primary_prioritized_learnings,"primary")
+    logging.info("Formatted the prompt for primary summary.")
+    logging.info(primary_prompt)
 
-        generate_summaries(secondary_prompt, secondary_output_file_path)
-        logging.info("Generated the secondary summary.")
+    generate_summaries(primary_prompt, primary_output_file_path)
+    logging.info("Generated the primary summary.")
 
-        process_summary(secondary_output_file_path,"secondary",3)
-        logging.info("Finalized processing secondary summary.")
-        logging.info("%s learnings retrieved, %s learnings prioritized.", len(filtered_learnings),len(secondary_prioritized_learnings))
+    process_summary(primary_output_file_path,"primary", primary_prompt, 3)
+    logging.info("Finalized processing primary summary.")
+    logging.info("%s learnings retrieved, %s learnings prioritized.", len(filtered_learnings),len(primary_prioritized_learnings))
 
-        logging.info("Complete summarization process done in %s seconds.", time.time() - start_time)
+    secondary_prioritized_learnings = prioritize_excerpts(contextualized_learnings,"secondary")
+    logging.info("Prioritized excerpts from learnings for secondary summary.")
 
-        
-    except Exception as e:
-        logging.error("An error occurred during the summarization process: %s", e)
-        raise
+    secondary_prompt = format_prompt(request_filter_path, secondary_prioritized_learnings,"secondary")
+    logging.info("Formatted the prompt for secondary summary.")
+    logging.info(secondary_prompt)
+
+    generate_summaries(secondary_prompt, secondary_output_file_path)
+    logging.info("Generated the secondary summary.")
+
+    process_summary(secondary_output_file_path,"secondary", secondary_prompt, 3)
+    logging.info("Finalized processing secondary summary.")
+    logging.info("%s learnings retrieved, %s learnings prioritized.", len(filtered_learnings),len(secondary_prioritized_learnings))
+
+
+def summarize_batch(request_filter_paths, output_dir, max_workers=SUMMARY_MAX_WORKERS):
+    """Summarizes the learnings of every request filter, from one data pull shared by all of them.
+
+    Each filter writes <output_dir>/<filter file name>_primary.json and _secondary.json.
+    A filter that fails is logged and the others go on; returns the paths of the failed filters.
+    """
+    start_time = time.time()
+    names = [os.path.splitext(os.path.basename(x))[0] for x in request_filter_paths]
+    if len(set(names)) != len(names):
+        raise ValueError("Request filter file names have to be unique, they name the output files.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    logging.info("Starting the batch summarization of %s request filters.", len(request_filter_paths))
+    learnings = query_many([read_json_file(x) for x in request_filter_paths])
+    logging.info("Queried and filtered learnings of every request filter.")
+
+    def summarize_filter(i):
+        if learnings[i] is None:
+            logging.error("The learnings of %s could not be queried, it is not summarized.", request_filter_paths[i])
+            return False
+        try:
+            summarize_learnings(request_filter_paths[i], learnings[i],
+                                os.path.join(output_dir, names[i] + '_primary.json'),
+                                os.path.join(output_dir, names[i] + '_secondary.json'))
+            logging.info("Summarized %s.", request_filter_paths[i])
+            return True
+        except Exception as e:
+            logging.error("An error occurred during the summarization of %s: %s", request_filter_paths[i], e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        succeeded = list(pool.map(summarize_filter, range(len(request_filter_paths))))
+
+    failed = [x for x, ok in zip(request_filter_paths, succeeded) if not ok]
+    logging.info("Batch summarization of %s request filters done in %s seconds, %s failed.", len(request_filter_paths), time.time() - start_time, len(failed))
+    return failed
 
 
 def main(request_filter_path, primary_output_file_path, secondary_output_file_path):
@@ -81,8 +130,12 @@ def main(request_filter_path, primary_output_file_path, secondary_output_file_pa
     
   
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
+    if len(sys.argv) >= 4 and sys.argv[1] == "--batch":
+        failed = summarize_batch(sys.argv[3:], sys.argv[2])
+        sys.exit(1 if failed else 0)
+    elif len(sys.argv) != 4:
         print("Usage: python summarize_go_learnings.py request_filter_path primary_output_file_path secondary_output_file_path")
+        print("       python summarize_go_learnings.py --batch output_dir request_filter_path [request_filter_path ...]")
     else:
         request_filter_path = sys.argv[1]
         primary_output_file_path = sys.argv[2]